@@ -0,0 +1,274 @@
+"""Benchmarks of the address book and of the file sorter on synthetic data.
+
+    python -m personal_manager.benchmark --sizes 1000 10000 --files 1000 --output results.json
+    python -m personal_manager.benchmark --baseline baseline.json --save-baseline
+    python -m personal_manager.benchmark --baseline baseline.json
+
+Every benchmark is timed over several runs and reported with latency percentiles and the peak memory
+of one extra run traced with tracemalloc. Results are written as JSON, compared with the baseline
+and the exit code is 1 if any benchmark got slower or bigger than the tolerance allows.
+The time to the first prompt of the console script is measured in a new process for every book size
+and has to stay under STARTUP_BUDGET whatever the size.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import date, datetime, timedelta
+from io import StringIO
+from itertools import islice
+from typing import Callable, Dict, List, Optional
+
+from personal_manager.personal_manager import STARTUP_BUDGET, AddressBook, Record, Tag, sort_files_entry_point
+
+FIRST_NAMES = ("Olena", "Andrii", "Iryna", "Oleksii", "Natalia", "Dmytro", "Kateryna", "Serhii", "Anna", "Maksym",
+               "Yulia", "Taras", "Sofia", "Bohdan", "Viktoria", "Ivan", "Maria", "Roman", "Daria", "Pavlo")
+LAST_NAMES = ("Kovalenko", "Bondarenko", "Tkachenko", "Shevchenko", "Kravchenko", "Melnyk", "Boiko", "Koval",
+              "Oliinyk", "Shevchuk", "Polishchuk", "Lysenko", "Marchenko", "Rudenko", "Moroz", "Savchenko")
+STREETS = ("Khreshchatyk", "Sumska", "Deribasivska", "Svobody", "Shevchenka", "Franka", "Lesi Ukrainky")
+DOMAINS = ("gmail.com", "ukr.net", "outlook.com", "example.org", "i.ua")
+WORDS = ("call", "meeting", "birthday", "gift", "project", "report", "invoice", "trip", "dinner", "review",
+         "contract", "deadline", "doctor", "flight", "hotel", "payment", "party", "training", "book", "car")
+TAGS = ("work", "family", "friends", "urgent", "travel", "finance", "health", "hobby", "shopping", "ideas")
+EXTENSIONS = ("jpg", "png", "svg", "txt", "pdf", "docx", "mp3", "wav", "mp4", "mkv", "zip", "gz", "py", "log")
+
+BENCHMARK_SIZES = (1000, 10000)
+BENCHMARK_FILES = (1000,)
+BENCHMARK_REPEAT = 200
+BENCHMARK_IO_REPEAT = 5
+BENCHMARK_TOLERANCE = 0.25
+BENCHMARK_SEED = 42
+STARTUP_PROMPT = b"Hello, please enter the command: "
+
+
+def synthetic_record(rng: random.Random, name: str) -> Record:
+    """A contact with 1-3 phones, 0-2 emails, an address, a birthday for most contacts and 0-4 tagged notes"""
+    login = name.lower().replace(" ", ".")
+    phones = [f"+380{rng.randrange(10**9):09d}" for _ in range(rng.randint(1, 3))]
+    emails = [f"{login}{index or ''}@{rng.choice(DOMAINS)}" for index in range(rng.randint(0, 2))]
+    address = [f"{rng.choice(STREETS)} str. {rng.randint(1, 200)}"]
+    birthday = None
+    if rng.random() < 0.8:
+        birthday = (date(1950, 1, 1) + timedelta(days=rng.randrange(365 * 55))).strftime("%d.%m.%Y")
+    notes = [" ".join(rng.choices(WORDS, k=rng.randint(3, 12))) for _ in range(rng.randint(0, 4))]
+    record = Record(name, phones, birthday, address, emails, notes)
+    for note in record.note:
+        note.tag.extend(Tag(tag) for tag in rng.sample(TAGS, rng.randint(0, 3)))
+    return record
+
+
+def synthetic_book(size: int, seed: int = BENCHMARK_SEED) -> AddressBook:
+    """An address book of size contacts with unique names, the same for the same seed"""
+    rng = random.Random(seed)
+    book = AddressBook()
+    for index in range(size):
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+        if name.capitalize() in book.data:
+            name = f"{name} {index}"
+        record = synthetic_record(rng, name)
+        book[record.name.value] = record
+    return book
+
+
+def synthetic_tree(path: str, files: int, seed: int = BENCHMARK_SEED, fanout: int = 4, depth: int = 3) -> None:
+    """Creates files with known and unknown extensions spread over nested folders under the path,
+    some of them with the same names to make collisions"""
+    rng = random.Random(seed)
+    folders = [path]
+    for level in range(depth):
+        folders.extend(os.path.join(folder, f"dir{level}_{index}") for folder in folders[-fanout ** level:]
+                       for index in range(fanout))
+    for folder in folders:
+        os.makedirs(folder, exist_ok=True)
+    for index in range(files):
+        name = f"file{rng.randrange(files // 2 + 1)}.{rng.choice(EXTENSIONS)}"
+        with open(os.path.join(rng.choice(folders), name), "wb") as fn:
+            fn.write(os.urandom(rng.randint(0, 4096)))
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+
+    def percentile(share: float) -> float:
+        return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+    return {"p50": percentile(0.5), "p90": percentile(0.9), "p99": percentile(0.99),
+            "min": ordered[0], "max": ordered[-1], "mean": sum(ordered) / len(ordered), "runs": len(ordered)}
+
+
+def measure(func: Callable[[], object], repeat: int, setup: Optional[Callable[[], None]] = None) -> Dict[str, float]:
+    """Times repeat runs of func, with setup before each run not timed, and traces one more run for the peak memory"""
+    samples = []
+    with redirect_stdout(StringIO()):
+        for _ in range(repeat):
+            if setup:
+                setup()
+            start = time.perf_counter()
+            func()
+            samples.append(time.perf_counter() - start)
+        if setup:
+            setup()
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    result = percentiles(samples)
+    result["peak_memory"] = peak
+    return result
+
+
+def book_benchmarks(size: int, repeat: int, workdir: str) -> Dict[str, Dict[str, float]]:
+    book = synthetic_book(size)
+    rng = random.Random(BENCHMARK_SEED)
+    names = list(book.data)
+    queries = [rng.choice(names).split()[rng.randint(0, 1)][:rng.randint(3, 6)] for _ in range(64)]
+    queries += [rng.choice(book.data[rng.choice(names)].phone).value[:7] for _ in range(64)]
+    tag_pairs = [rng.sample(TAGS, 2) for _ in range(64)]
+    note_queries = [" ".join(rng.sample(WORDS, 2)) for _ in range(32)] + \
+        [f"\"{' '.join(rng.sample(WORDS, 2))}\"" for _ in range(16)] + [f"{rng.choice(WORDS)[:3]}*" for _ in range(16)]
+    filename = os.path.join(workdir, f"book_{size}.bin")
+    results = {
+        "find_contact": measure(lambda: book.search_contacts(rng.choice(queries)), repeat),
+        "holidays_period": measure(lambda: book.upcoming_birthdays(rng.randint(1, 365)), repeat),
+        "find_sort_note": measure(lambda: book.notes_by_tags(rng.choice(tag_pairs), match_all=True), repeat),
+        "search_notes": measure(lambda: book.search_notes(rng.choice(note_queries)), repeat),
+    }
+    for sort_by in (None, "name", "birthday"):
+        results[f"iterator[{sort_by or 'added'}]"] = measure(
+            lambda: list(islice(book.iterator(20, sort_by), 10)), repeat)
+    results["save_data"] = measure(lambda: book.save_data(filename), BENCHMARK_IO_REPEAT)
+    results["load_data"] = measure(lambda: AddressBook().load_data(filename), BENCHMARK_IO_REPEAT)
+    return {f"{benchmark}[{size}]": result for benchmark, result in results.items()}
+
+
+def time_to_prompt(filename: str) -> float:
+    """Starts the console script with the data file and returns the seconds until it asks for the first command"""
+    env = dict(os.environ, PERSONAL_MANAGER_DATA=filename)
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-c", "from personal_manager.personal_manager import main; main()"],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+    output = b""
+    while STARTUP_PROMPT not in output:
+        chunk = os.read(process.stdout.fileno(), 4096)
+        if not chunk:
+            break
+        output += chunk
+    elapsed = time.perf_counter() - start
+    process.communicate(b"exit\n")
+    return elapsed
+
+
+def startup_benchmark(size: int, workdir: str) -> Dict[str, Dict[str, float]]:
+    filename = os.path.join(workdir, f"startup_{size}.bin")
+    with redirect_stdout(StringIO()):
+        synthetic_book(size).save_data(filename)
+    result = percentiles([time_to_prompt(filename) for _ in range(BENCHMARK_IO_REPEAT)])
+    result["peak_memory"] = 0
+    return {f"time_to_prompt[{size}]": result}
+
+
+def sort_benchmark(files: int, workdir: str) -> Dict[str, Dict[str, float]]:
+    path = os.path.join(workdir, f"tree_{files}")
+
+    def setup() -> None:
+        shutil.rmtree(path, ignore_errors=True)
+        synthetic_tree(path, files)
+
+    return {f"sort_files_entry_point[{files}]": measure(lambda: sort_files_entry_point(path), BENCHMARK_IO_REPEAT, setup)}
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            tolerance: float = BENCHMARK_TOLERANCE) -> List[str]:
+    """Returns descriptions of the benchmarks whose median time or peak memory grew over the tolerance"""
+    regressions = []
+    for benchmark, result in results.items():
+        base = baseline.get(benchmark)
+        if not base:
+            continue
+        for metric in ("p50", "peak_memory"):
+            if base.get(metric) and result[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f"{benchmark}: {metric} {result[metric]:.6g} > {base[metric]:.6g} "
+                                   f"(+{result[metric] / base[metric] - 1:.0%})")
+    return regressions
+
+
+def over_budget(results: Dict[str, Dict[str, float]], budget: float = STARTUP_BUDGET) -> List[str]:
+    """Returns descriptions of the startup benchmarks whose median time to the first prompt is over the budget"""
+    return [f"{benchmark}: p50 {result['p50']:.6g} > budget {budget:.6g}" for benchmark, result in results.items()
+            if benchmark.startswith("time_to_prompt") and result["p50"] > budget]
+
+
+def run(sizes: List[int], files: List[int], repeat: int = BENCHMARK_REPEAT) -> Dict[str, object]:
+    workdir = tempfile.mkdtemp(prefix="personal_manager_benchmark_")
+    try:
+        results = {}
+        for size in sizes:
+            results.update(book_benchmarks(size, repeat, workdir))
+            results.update(startup_benchmark(size, workdir))
+        for count in files:
+            results.update(sort_benchmark(count, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {"created": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+            "platform": platform.platform(), "results": results}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks of the personal manager on synthetic data")
+    parser.add_argument("--sizes", type=int, nargs="*", default=list(BENCHMARK_SIZES),
+                        help="numbers of contacts of the synthetic address books, up to 1000000")
+    parser.add_argument("--files", type=int, nargs="*", default=list(BENCHMARK_FILES),
+                        help="numbers of files of the synthetic trees to sort")
+    parser.add_argument("--repeat", type=int, default=BENCHMARK_REPEAT, help="runs of every address book query")
+    parser.add_argument("--output", help="JSON file for the results, printed if not given")
+    parser.add_argument("--baseline", help="JSON file with the results to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=BENCHMARK_TOLERANCE,
+                        help="allowed relative growth of the median time and of the peak memory")
+    args = parser.parse_args(argv)
+    report = run(args.sizes, args.files, args.repeat)
+    for benchmark, result in report["results"].items():
+        print(f"{benchmark:<40} p50 {result['p50'] * 1000:10.3f} ms  p99 {result['p99'] * 1000:10.3f} ms  "
+              f"peak {result['peak_memory'] / 1024:10.1f} KiB")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fn:
+            json.dump(report, fn, indent=2)
+    elif not args.baseline:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    failures = over_budget(report["results"])
+    for failure in failures:
+        print(f"Over the startup budget: {failure}")
+    if not args.baseline:
+        return 1 if failures else 0
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as fn:
+            json.dump(report, fn, indent=2)
+        print(f"Saved the baseline to \"{args.baseline}\"")
+        return 0
+    try:
+        with open(args.baseline, encoding="utf-8") as fn:
+            baseline = json.load(fn)["results"]
+    except (FileNotFoundError, ValueError, KeyError):
+        print(f"An error occurred while opening the baseline \"{args.baseline}\"")
+        return 1
+    regressions = compare(report["results"], baseline, args.tolerance)
+    for regression in regressions:
+        print(f"Regression: {regression}")
+    if not regressions:
+        print("No regressions compared with the baseline.")
+    return 1 if regressions or failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""Thin client of the personal manager daemon started with "personal-manager --serve".
+
+    personal-manager-client find_contact query=olena
+    personal-manager-client --socket=/run/book.sock add_note name=Olena note="call back" tags="work;urgent"
+    personal-manager-client < commands.txt
+
+Commands and their parameters are the same as in the batch mode. Every command is answered by one
+JSON line with its result or error. Only the standard library is imported, so a query costs
+the start of the interpreter and a round-trip over the Unix socket, not a load of the address book.
+"""
+import json
+import os
+import socket
+import sys
+from typing import Dict, Iterable, Iterator, List, Optional
+
+DAEMON_SOCKET = "~/.personal_manager.sock"
+
+
+def daemon_socket(path: Optional[str] = None) -> str:
+    """The socket path given, from PERSONAL_MANAGER_SOCKET or DAEMON_SOCKET"""
+    return os.path.expanduser(path or os.environ.get("PERSONAL_MANAGER_SOCKET") or DAEMON_SOCKET)
+
+
+class Client:
+    """Connection to the daemon, commands are sent as JSON lines and answered in order"""
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = daemon_socket(path)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(self.path)
+        self.reader = self.socket.makefile("r", encoding="utf-8")
+        self.writer = self.socket.makefile("w", encoding="utf-8")
+
+    def __enter__(self) -> "Client":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def send(self, lines: Iterable[str]) -> Iterator[Dict]:
+        """Sends the command lines one by one and yields the answer to each of them"""
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            self.writer.write(line + "\n")
+            self.writer.flush()
+            answer = self.reader.readline()
+            if not answer:
+                raise ConnectionError("The daemon closed the connection")
+            yield json.loads(answer)
+
+    def call(self, command: str, **params):
+        """Runs one command and returns its result, an error of the command is raised as ValueError"""
+        answer = next(self.send([json.dumps({"command": command, **params}, ensure_ascii=False)]))
+        if not answer["ok"]:
+            raise ValueError(answer["error"])
+        return answer["result"]
+
+    def close(self) -> None:
+        for stream in (self.reader, self.writer, self.socket):
+            stream.close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Sends the command of the arguments, or the lines of stdin without them, and prints the answers.
+    Returns 1 if any command failed and 2 if the daemon is not running or drops the connection."""
+    argv = sys.argv[1:] if argv is None else argv
+    path = None
+    if argv and argv[0].startswith("--socket="):
+        path, argv = argv[0].partition("=")[2], argv[1:]
+    if argv:
+        from shlex import join
+        lines = [join(argv)]
+    else:
+        lines = sys.stdin
+    try:
+        client = Client(path)
+    except OSError:
+        print(f"The daemon is not running on \"{daemon_socket(path)}\", start it with personal-manager --serve",
+              file=sys.stderr)
+        return 2
+    failed = 0
+    with client:
+        try:
+            for answer in client.send(lines):
+                failed += not answer["ok"]
+                print(json.dumps(answer, ensure_ascii=False))
+        except ConnectionError as error:
+            print(f"The connection to the daemon on \"{client.path}\" is lost: {error}", file=sys.stderr)
+            return 2
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,92 +1,792 @@
+import errno
+import json
+import math
+import mmap
 import pickle
 import re
-from collections import UserDict
-from datetime import datetime, timedelta
-from difflib import get_close_matches
+import shlex
+import signal
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter, OrderedDict, UserDict, deque
+from collections.abc import MutableMapping
+from contextlib import contextmanager, nullcontext, redirect_stdout
+from heapq import merge, nlargest
+from itertools import count, islice
+from datetime import date, datetime, timedelta
+from io import StringIO
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Collection, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 import os
-import shutil
-from pick import pick
+import sys
+import threading
+import time
+import tracemalloc
+from personal_manager.client import daemon_socket
 
 CATEGORIES = {'images': ('JPEG', 'PNG', 'JPG', 'SVG'), 'documents': ('DOC', 'DOCX', 'TXT', 'PDF', 'XLSX', 'PPTX'),
               'audio': ('MP3', 'OGG', 'WAV', 'AMR'), 'video': ('AVI', 'MP4', 'MOV', 'MKV'), 'archives': ('ZIP', 'GZ', 'TAR')}
 
-file_log = []
+OUTPUT_BUFFER_SIZE = 1 << 16
+JOURNAL_COMPACT_SIZE = 1 << 22
+AUTOSAVE_INTERVAL = 60
+AUTOSAVE_CHANGES = 100
+SQLITE_CACHE_SIZE = 10000
+SQLITE_SUFFIXES = (".db", ".sqlite")
+IMPORT_BATCH_SIZE = 10000
+IMPORT_REBUILD_SHARE = 10
+IMPORT_REPORT_ERRORS = 100
+CSV_FIELDS = ("name", "phones", "birthday", "addresses", "emails", "notes", "tags")
+VCARD_SUFFIXES = (".vcf", ".vcard")
+FUZZY_LIMIT = 10
+FUZZY_THRESHOLD = 0.3
+NOTE_SEARCH_LIMIT = 10
+BIRTHDAY_PATTERN = re.compile(r"(\d{1,2})\.(\d{1,2})\.(\d{4})")
+SORT_WORKERS = 8
+SORT_BATCH_SIZE = 1000
+SORT_MANIFEST = ".sort_manifest.jsonl"
+SORT_DONE_SUFFIX = ".done"
+SORT_STATE = ".sort_state.json"
+SORT_HASH_INDEX = ".hash_index.json"
+SORT_HASH_CHUNK = 1 << 16
+SORT_DUPLICATES = "link"
+SORT_WATCH_INTERVAL = 5
+SORT_MODES = ("sort", "dry run", "incremental", "undo", "watch")
+SORT_CATEGORIES_CONFIG = "~/.personal_manager_categories.json"
+SORT_SNIFF_SIZE = 512
+SORT_COPY_CHUNK = 1 << 26
+SORT_PROGRESS_SIZE = 1 << 28
+SORT_PROGRESS_INTERVAL = 1
+SORT_REPORT_ERRORS = 100
+STARTUP_BUDGET = 0.5
+OFFLINE_COMMANDS = ("sort_files",)
+MAGIC_NUMBERS = ((0, b'\xff\xd8\xff', 'JPG'), (0, b'\x89PNG\r\n\x1a\n', 'PNG'), (0, b'<svg', 'SVG'),
+                 (0, b'%PDF', 'PDF'), (0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'DOC'), (0, b'ID3', 'MP3'),
+                 (0, b'\xff\xfb', 'MP3'), (0, b'OggS', 'OGG'), (8, b'WAVE', 'WAV'), (0, b'#!AMR', 'AMR'),
+                 (8, b'AVI ', 'AVI'), (4, b'ftyp', 'MP4'), (0, b'\x1aE\xdf\xa3', 'MKV'), (0, b'PK\x03\x04', 'ZIP'),
+                 (0, b'\x1f\x8b', 'GZ'), (257, b'ustar', 'TAR'))
+
+classifier = None
+
+
+def pick(*args, **kwargs):
+    """pick.pick imported on the first menu, it pulls in curses which is slow to import at the start"""
+    from pick import pick as pick_menu
+    return pick_menu(*args, **kwargs)
 
-def folder_path(path):
-    if os.path.exists(path):
-        global base_path
-        base_path = path
-        return sort_files(base_path)
-    else:
-        print('Wrong path!')
 
 def rename_exists_files(name):
-    return name + '_edit_' + datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S.%f')
-
-def log():
-    final_dict = {}
-    for i in file_log:
-        for k, v in i.items():
-            final_dict.setdefault(k, []).append(v)
-    for k, v in final_dict.items():
-        print(f'---{k}---')
-        print(', '.join(v))
+    return name + '_edit_' + datetime.now().strftime('%Y-%m-%d_%H-%M-%S.%f')
+
+def log(report):
+    print(report)
     print(f"Sorting in the {base_path} catalog has been completed successfully.")
 
 def ignore_list():
     ignore = []
-    for k in CATEGORIES.keys():
+    for k in default_classifier().categories.keys():
         ignore.append(k)
     return ignore
 
-def remove_folders(path):
-    folders = list(os.walk(path))
-    for path, _, _ in folders[::-1]:
-        if len(os.listdir(path)) == 0:
-            os.rmdir(path)
-
-def move_files(file_path):
-    dirname, fname = os.path.split(file_path)
-    extension = os.path.splitext(fname)[1].upper().replace('.', '')
-    for k, v in CATEGORIES.items():
-        if extension in v:
-            os.makedirs(base_path + '/' + k, exist_ok=True)
-            if os.path.exists(os.path.join(base_path + '/' + k, fname)):
-                new_f_renamed = rename_exists_files(os.path.splitext(fname)[0]) + os.path.splitext(fname)[1]
-                shutil.move(os.path.join(file_path), os.path.join(base_path + '/' + k, new_f_renamed))
-                file_log.append({k: new_f_renamed})
-            else:
-                shutil.move(os.path.join(file_path), os.path.join(base_path + '/' + k, fname))
-                file_log.append({k: fname})
+def prune_folders(folders, base):
+    """Removes the folders left empty by the moves and then their parents that became empty,
+    up to the base folder, without scanning the rest of the tree"""
+    for folder in set(folders):
+        while folder != base and os.path.dirname(folder) != folder:
+            try:
+                os.rmdir(folder)
+            except OSError:
+                break
+            folder = os.path.dirname(folder)
+
+def remove_empty_folder(folder):
+    try:
+        os.rmdir(folder)
+    except OSError:
+        pass
+
+class Classifier:
+    """Finds the category of a file by its extension in a dictionary built from CATEGORIES and the categories
+    of the user's config file. Files with an unknown or no extension are recognized by the magic bytes
+    at the head of the file, these results are cached by (inode, mtime, size)."""
+
+    def __init__(self, categories=None, config=None):
+        self.categories = {k: tuple(v) for k, v in (categories or CATEGORIES).items()}
+        for k, v in self.load_config(config).items():
+            self.categories[k] = self.categories.get(k, ()) + tuple(extension.upper().lstrip('.') for extension in v)
+        self.extensions = {extension: k for k, v in self.categories.items() for extension in v}
+        self._sniffed: Dict[Tuple[int, int, int], Optional[str]] = {}
+
+    @staticmethod
+    def load_config(config=None):
+        """Reads {category: [extensions]} from the JSON config file, see SORT_CATEGORIES_CONFIG"""
+        config = config or os.environ.get("PERSONAL_MANAGER_CATEGORIES", os.path.expanduser(SORT_CATEGORIES_CONFIG))
+        try:
+            with open(config, encoding="utf-8") as fn:
+                return json.load(fn)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            print(f"The categories config \"{config}\" is damaged and was ignored")
+            return {}
+
+    def classify(self, fname, entry=None):
+        """Returns the category of the file or None if it is unknown. The content is sniffed only
+        if the os.DirEntry of the file is given and its extension is unknown."""
+        category = self.extensions.get(os.path.splitext(fname)[1][1:].upper())
+        if category or entry is None:
+            return category
+        stat = entry.stat()
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if key not in self._sniffed:
+            self._sniffed[key] = self.sniff(entry.path)
+        return self._sniffed[key]
+
+    def sniff(self, file_path):
+        try:
+            with open(file_path, 'rb') as fn:
+                head = fn.read(SORT_SNIFF_SIZE)
+        except OSError:
+            return None
+        for offset, magic, extension in MAGIC_NUMBERS:
+            if head[offset: offset + len(magic)] == magic:
+                if extension == "MP4" and head[8:10] == b"qt":
+                    extension = "MOV"
+                return self.extensions.get(extension)
+        return None
+
+
+def default_classifier():
+    global classifier
+    if classifier is None:
+        classifier = Classifier()
+    return classifier
+
+def file_category(fname, entry=None):
+    """Returns the category of the file or None if it is unknown, see Classifier"""
+    return default_classifier().classify(fname, entry)
+
+
+def file_digest(path, quick=False):
+    """Returns the hash of the head and the tail of the file or, if quick is False, of its whole content"""
+    import hashlib
+    with open(path, 'rb') as fn:
+        size = os.fstat(fn.fileno()).st_size
+        if quick:
+            digest = hashlib.blake2b(fn.read(SORT_HASH_CHUNK))
+            if size > SORT_HASH_CHUNK:
+                fn.seek(max(SORT_HASH_CHUNK, size - SORT_HASH_CHUNK))
+                digest.update(fn.read())
+            return digest.hexdigest()
+        if not size:
+            return hashlib.blake2b().hexdigest()
+        with mmap.mmap(fn.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return hashlib.blake2b(mm).hexdigest()
+
+
+def copy_file(source, destination, progress=None):
+    """Copies the content of the file in the kernel with os.copy_file_range or os.sendfile in SORT_COPY_CHUNK
+    chunks, falls back to reading and writing it if neither works, calls progress(copied, size) after each chunk.
+    Like shutil, a method copying nothing at the start of the file is taken as unsupported for it"""
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        size = os.fstat(src.fileno()).st_size
+        copied = 0
+        for method in ("copy_file_range", "sendfile"):
+            copy = getattr(os, method, None)
+            if copy is None:
+                continue
+            try:
+                while copied < size:
+                    if method == "sendfile":
+                        sent = copy(dst.fileno(), src.fileno(), copied, SORT_COPY_CHUNK)
+                    else:
+                        sent = copy(src.fileno(), dst.fileno(), SORT_COPY_CHUNK, copied, copied)
+                    if not sent:
+                        break
+                    copied += sent
+                    if progress:
+                        progress(copied, size)
+                else:
+                    return copied
+            except OSError:
+                if copied:
+                    raise
+            if copied:
+                return copied
+        while True:
+            chunk = src.read(SORT_COPY_CHUNK)
+            if not chunk:
+                return copied
+            dst.write(chunk)
+            copied += len(chunk)
+            if progress:
+                progress(copied, size)
+
+
+def transfer_progress(name, size):
+    """Returns a progress callback printing the transferred size and throughput of a large file
+    at most once per SORT_PROGRESS_INTERVAL seconds, or None for a file smaller than SORT_PROGRESS_SIZE"""
+    if size < SORT_PROGRESS_SIZE:
+        return None
+    start = last = time.monotonic()
+
+    def progress(copied, total):
+        nonlocal last
+        now = time.monotonic()
+        if now - last < SORT_PROGRESS_INTERVAL and copied < total:
+            return
+        last = now
+        rate = copied / max(now - start, 1e-6) / (1 << 20)
+        print(f"{name}: {copied >> 20}/{total >> 20} MB, {rate:.1f} MB/s")
+
+    return progress
+
+
+def move_file(source, destination):
+    """Renames the file and, if the destination is on another filesystem, copies it with copy_file,
+    keeps its permissions and times and removes the source once the whole file is copied.
+    Symbolic links are left to shutil.move"""
+    try:
+        os.rename(source, destination)
+        return
+    except OSError as error:
+        if error.errno != errno.EXDEV:
+            raise
+    import shutil
+    if os.path.islink(source):
+        shutil.move(source, destination)
+        return
+    try:
+        size = os.path.getsize(source)
+        copied = copy_file(source, destination, transfer_progress(os.path.basename(source), size))
+        if copied != size:
+            raise OSError(errno.EIO, f"Copied {copied} of {size} bytes", source)
+        shutil.copystat(source, destination)
+    except BaseException:
+        try:
+            os.remove(destination)
+        except OSError:
+            pass
+        raise
+    os.remove(source)
 
-def sort_files(path):
-    subfolders = []
-    files = []
+
+class HashIndex:
+    """Sizes and content hashes of the files of a category folder persisted in its SORT_HASH_INDEX file.
+    An entry is [size, mtime_ns, quick hash, full hash], the hashes are computed only when they are needed
+    and reused while the size and the mtime of the file stay the same."""
+
+    def __init__(self, folder, names):
+        self.folder = folder
+        self.file_name = os.path.join(folder, SORT_HASH_INDEX)
+        try:
+            with open(self.file_name, encoding="utf-8") as fn:
+                entries = json.load(fn)
+        except (FileNotFoundError, ValueError):
+            entries = {}
+        self._entries = {name: entry for name, entry in entries.items() if name in names}
+        self._changed = False
+
+    def _entry(self, path, name):
+        stat = os.stat(path)
+        entry = self._entries.get(name)
+        if not entry or entry[:2] != [stat.st_size, stat.st_mtime_ns]:
+            entry = self._entries[name] = [stat.st_size, stat.st_mtime_ns, None, None]
+        return entry
+
+    def _hash(self, entry, path, position):
+        if entry[position] is None:
+            entry[position] = file_digest(path, quick=position == 2)
+            self._changed = True
+        return entry[position]
+
+    def same(self, path, name, other_path, other_name):
+        """Compares the sizes, the hashes of heads and tails and at last the full hashes of two files"""
+        entry, other = self._entry(path, name), self._entry(other_path, other_name)
+        return entry[0] == other[0] and all(self._hash(entry, path, position) == \
+            self._hash(other, other_path, position) for position in (2, 3))
+
+    def rename(self, name, new_name):
+        if name in self._entries:
+            self._entries[new_name] = self._entries.pop(name)
+
+    def save(self):
+        if self._changed and os.path.isdir(self.folder):
+            with open(self.file_name + ".tmp", "w", encoding="utf-8") as fn:
+                json.dump(self._entries, fn)
+            os.replace(self.file_name + ".tmp", self.file_name)
+            self._changed = False
+
+
+class SortReport:
+    """Counters of a sorting run: moved files and bytes per category, renamed collisions, duplicates,
+    errors with only the last SORT_REPORT_ERRORS messages kept, and wall-clock seconds of the stages.
+    The per-file listing is never kept in memory, it is streamed as JSON lines into the listing file if one is given."""
+
+    STAGES = ("scan", "classify", "move", "cleanup")
+
+    def __init__(self, listing=None):
+        self.files: Dict[str, int] = {}
+        self.bytes: Dict[str, int] = {}
+        self.collisions = 0
+        self.duplicates = 0
+        self.errors = 0
+        self.last_errors = deque(maxlen=SORT_REPORT_ERRORS)
+        self.stages = dict.fromkeys(self.STAGES, 0.0)
+        self.listing = listing
+        self._listing = None
+
+    def moved(self, source, destination, size):
+        category = os.path.basename(os.path.dirname(destination))
+        self.files[category] = self.files.get(category, 0) + 1
+        self.bytes[category] = self.bytes.get(category, 0) + size
+        if self.listing:
+            if self._listing is None:
+                self._listing = open(self.listing, "a", encoding="utf-8")
+            self._listing.write(json.dumps({"category": category, "source": source,
+                                            "destination": destination, "size": size}) + "\n")
+
+    def failed(self, source, error):
+        self.errors += 1
+        self.last_errors.append(f"{source}: {error}")
+
+    def timed(self, stage, start):
+        """Adds the time passed since the time.monotonic() start to the stage"""
+        self.stages[stage] += time.monotonic() - start
+
+    def scan(self, events):
+        """Passes the events of walk_files through and counts the time spent listing the folders
+        as the scan stage, the classification done by walk_files is counted separately"""
+        events = iter(events)
+        while True:
+            classify = self.stages["classify"]
+            start = time.monotonic()
+            event = next(events, None)
+            self.timed("scan", start)
+            self.stages["scan"] -= self.stages["classify"] - classify
+            if event is None:
+                return
+            yield event
+
+    def close(self):
+        if self._listing:
+            self._listing.close()
+            self._listing = None
+
+    def to_dict(self):
+        return {"moved": sum(self.files.values()), "bytes_moved": sum(self.bytes.values()),
+                "files": self.files, "bytes": self.bytes, "collisions": self.collisions,
+                "duplicates": self.duplicates, "errors": self.errors, "last_errors": list(self.last_errors),
+                "stages": {stage: round(seconds, 6) for stage, seconds in self.stages.items()}}
+
+    def save(self, file_name):
+        with open(file_name, "w", encoding="utf-8") as fn:
+            json.dump(self.to_dict(), fn, indent=2)
+
+    def __str__(self):
+        lines = [f"---{category}--- {count} files, {self.bytes[category]} bytes"
+                 for category, count in sorted(self.files.items())]
+        lines.append(f"Moved: {sum(self.files.values())} files, {sum(self.bytes.values())} bytes. "
+                     f"Collisions: {self.collisions}. Duplicates: {self.duplicates}. Errors: {self.errors}.")
+        lines.extend(self.last_errors)
+        lines.append("Time: " + ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in self.stages.items()))
+        return "\n".join(lines)
+
+
+class MoveExecutor:
+    """Moves files into the category folders of the base path.
+    Destinations are planned in the calling thread in the order of the moves, so the result is the same
+    as of a serial run, and only the moves themselves run in a bounded pool of worker threads.
+    A file colliding with an identical one in the category folder is hard-linked to it ("link"),
+    left in place ("skip") or renamed and moved like any other collision ("keep").
+    The outcome of the moves is counted in the report."""
+
+    def __init__(self, base, workers=None, duplicates=None, report=None):
+        self.base = base
+        self.report = report or SortReport()
+        self.workers = workers or int(os.environ.get("PERSONAL_MANAGER_SORT_WORKERS", SORT_WORKERS))
+        self.duplicates = duplicates or os.environ.get("PERSONAL_MANAGER_SORT_DUPLICATES", SORT_DUPLICATES)
+        self._taken: Dict[str, Dict[str, str]] = {}
+        self._hashes: Dict[str, HashIndex] = {}
+        self._created: Set[str] = set()
+
+    def reserve(self, category, file_path):
+        """Returns (destination, link target) for the file in the category folder without touching the filesystem.
+        The link target is the identical file the destination should be linked to, if any.
+        The destination is None if the duplicate should stay in place. A reserved name points at the source
+        until apply has moved the file, then at the file in the category folder."""
+        fname = os.path.basename(file_path)
+        folder = os.path.join(self.base, category)
+        taken = self._taken.get(folder)
+        if taken is None:
+            names = os.listdir(folder) if os.path.isdir(folder) else []
+            taken = self._taken[folder] = {name: os.path.join(folder, name) for name in names}
+            self._hashes[folder] = HashIndex(folder, taken)
+        hashes = self._hashes[folder]
+        link = None
+        if fname in taken and self.duplicates != "keep" and hashes.same(taken[fname], fname, file_path, file_path):
+            self.report.duplicates += 1
+            if self.duplicates == "skip":
+                return None, None
+            link = os.path.join(folder, fname)
+        new_name = fname
+        if new_name in taken and not link:
+            self.report.collisions += 1
+        while new_name in taken:
+            new_name = rename_exists_files(os.path.splitext(fname)[0]) + os.path.splitext(fname)[1]
+        taken[new_name] = file_path
+        hashes.rename(file_path, new_name)
+        return os.path.join(folder, new_name), link
+
+    def plan(self, moves):
+        """Turns (file path, category) pairs into (source, destination, link target) moves"""
+        for file_path, category in moves:
+            start = time.monotonic()
+            destination, link = self.reserve(category, file_path)
+            self.report.timed("classify", start)
+            if destination:
+                yield file_path, destination, link
+
+    def save_hashes(self):
+        start = time.monotonic()
+        for hashes in self._hashes.values():
+            hashes.save()
+        self.report.timed("cleanup", start)
+
+    def _move(self, source, destination, link=None):
+        """Returns (source, actual destination, size, error)"""
+        try:
+            try:
+                size = os.stat(source).st_size
+            except FileNotFoundError:
+                if os.path.exists(destination):
+                    return source, destination, os.path.getsize(destination), None
+                return source, None, 0, None
+            if os.path.exists(destination):
+                name, extension = os.path.splitext(destination)
+                destination = rename_exists_files(name) + extension
+            if link:
+                try:
+                    os.link(link, destination)
+                    os.remove(source)
+                    return source, destination, size, None
+                except OSError:
+                    pass
+            move_file(source, destination)
+            return source, destination, size, None
+        except OSError as error:
+            return source, None, 0, error
+
+    def apply(self, moves):
+        """Applies (source, destination, link target) moves and returns (source, actual destination) pairs
+        in the same order. The destination is None if the source has disappeared. A move whose source is gone
+        but destination exists counts as done by an interrupted run. Links are made after the moves
+        of the batch, so the files they point to are already in place. A move that fails is counted
+        as an error of the report and has no destination either."""
+        start = time.monotonic()
+        tasks = []
+        for task in moves:
+            folder = os.path.dirname(task[1])
+            if folder not in self._created:
+                os.makedirs(folder, exist_ok=True)
+                self._created.add(folder)
+            tasks.append(task)
+        results = [None] * len(tasks)
+        for linked in (False, True):
+            indexes = [index for index, task in enumerate(tasks) if bool(task[2]) == linked]
+            if self.workers <= 1:
+                done = [self._move(*tasks[index]) for index in indexes]
+            else:
+                from concurrent.futures import ThreadPoolExecutor
+                with ThreadPoolExecutor(self.workers) as pool:
+                    done = list(pool.map(lambda index: self._move(*tasks[index]), indexes))
+            for index, result in zip(indexes, done):
+                results[index] = result
+        for index, (source, destination, size, error) in enumerate(results):
+            if error:
+                self.report.failed(source, error)
+            elif destination:
+                self.report.moved(source, destination, size)
+            self._placed(tasks[index][1], source, destination)
+            results[index] = source, destination
+        self.report.timed("move", start)
+        return results
+
+    def _placed(self, reserved, source, destination):
+        """Points the name reserved for the source at the file now in the category folder, so a file of a later batch
+        with the same name is compared with it and not with the moved source. A name of a failed move is freed."""
+        taken = self._taken.get(os.path.dirname(reserved))
+        name = os.path.basename(reserved)
+        if taken is None or taken.get(name) != source:
+            return
+        if destination is None:
+            del taken[name]
+            return
+        taken[name] = reserved
+        if destination != reserved:
+            taken[os.path.basename(destination)] = destination
+
+    def run(self, events, batch_size=None):
+        """Sorts the events of walk_files in one pass: files are moved in batches and the empty folders
+        left behind, except the base folder, are removed once the batch with their last files has been applied.
+        Returns the number of moved files."""
+        moved = 0
+        batch, folders = [], []
+        for event in self.report.scan(events):
+            if event[0] == "folder":
+                if event[1] != self.base:
+                    folders.append(event[1])
+                continue
+            start = time.monotonic()
+            destination, link = self.reserve(event[2], event[1])
+            self.report.timed("classify", start)
+            if destination:
+                batch.append((event[1], destination, link))
+            if len(batch) >= (batch_size or SORT_BATCH_SIZE):
+                moved += sum(1 for _, destination in self.apply(batch) if destination)
+                batch = []
+                self._prune(folders)
+                folders = []
+        moved += sum(1 for _, destination in self.apply(batch) if destination)
+        self._prune(folders)
+        self.save_hashes()
+        return moved
+
+    def _prune(self, folders):
+        start = time.monotonic()
+        for folder in folders:
+            remove_empty_folder(folder)
+        self.report.timed("cleanup", start)
+
+
+def walk_files(path, state=None, new_state=None, report=None):
+    """Iterative depth-first scandir walk over the folder and its subfolders except the category folders.
+    Yields ("file", file path, category) for the files with known categories, the files of a folder
+    before its subfolders, and ("folder", folder path) after the whole subtree of a folder was visited.
+    The stack holds only the pending subfolders along the current path, the files are never collected.
+    With the state of the previous run (see load_sort_state) folders with an unchanged mtime are not listed
+    again, only their known subfolders are visited. The state of this run is collected into new_state.
+    The time spent classifying the files is counted in the report."""
     ignore = ignore_list()
-    for i in os.scandir(path):
-        if i.is_dir():
-            if i.name not in ignore:
-                old_path = os.path.dirname(i.path)
-                os.rename(os.path.join(old_path, i.name), os.path.join(old_path, i.name))
-                subfolders.append(os.path.join(old_path, i.name))
-        if i.is_file():
-            old_path = os.path.dirname(i.path)
-            os.rename(os.path.join(old_path, i.name), os.path.join(old_path, i.name))
-            files.append(os.path.join(old_path, i.name))
-            move_files(os.path.join(old_path, i.name))
-    for dir in list(subfolders):
-        sf, i = sort_files(dir)
-        subfolders.extend(sf)
-        files.extend(i)
-
-    return subfolders, files
-
-def sort_files_entry_point(path):
-    folder_path(path)
-    remove_folders(base_path)
-    log()
+    stack = [(path, False)]
+    while stack:
+        folder, visited = stack.pop()
+        if visited:
+            yield "folder", folder
+            continue
+        stack.append((folder, True))
+        if state is not None:
+            try:
+                mtime = os.stat(folder).st_mtime_ns
+            except FileNotFoundError:
+                stack.pop()
+                continue
+            known = state.get(folder)
+            if known and known[0] == mtime:
+                new_state[folder] = known
+                stack.extend((os.path.join(folder, dir), False) for dir in reversed(known[1]))
+                continue
+        subfolders = []
+        for i in os.scandir(folder):
+            if i.is_dir():
+                if i.name not in ignore:
+                    subfolders.append(i.name)
+            elif i.is_file():
+                start = time.monotonic()
+                category = file_category(i.name, i)
+                if report:
+                    report.timed("classify", start)
+                if category:
+                    yield "file", i.path, category
+        if new_state is not None:
+            new_state[folder] = [mtime, subfolders]
+        stack.extend((os.path.join(folder, dir), False) for dir in reversed(subfolders))
+
+def plan_moves(path, state=None, new_state=None, report=None):
+    """Yields (file path, category) pairs of the files found by walk_files"""
+    events = walk_files(path, state, new_state, report)
+    for event in (report.scan(events) if report else events):
+        if event[0] == "file":
+            yield event[1], event[2]
+
+def read_manifest(manifest):
+    """Yields (source, destination, link target) moves of the manifest or of its checkpoint file"""
+    try:
+        with open(manifest, encoding="utf-8") as fn:
+            for line in fn:
+                if line.endswith("\n"):
+                    move = json.loads(line)
+                    yield move["source"], move["destination"], move.get("link")
+    except FileNotFoundError:
+        return
+
+def write_moves(fn, moves):
+    """Appends (source, destination[, link target]) moves to the manifest and returns the number of moved files"""
+    count = 0
+    for source, destination, *link in moves:
+        move = {"source": source, "destination": destination}
+        if link and link[0]:
+            move["link"] = link[0]
+        fn.write(json.dumps(move) + "\n")
+        count += destination is not None
+    fn.flush()
+    os.fsync(fn.fileno())
+    return count
+
+def plan_sort(path, manifest, report=None):
+    """Stage one: streams the planned moves of the folder into the manifest file and returns their number.
+    Any checkpoint of a previous run of this manifest is discarded."""
+    executor = MoveExecutor(path, report=report)
+    with open(manifest, "w", encoding="utf-8") as fn:
+        planned = write_moves(fn, executor.plan(plan_moves(path, report=executor.report)))
+    executor.save_hashes()
+    if os.path.exists(manifest + SORT_DONE_SUFFIX):
+        os.remove(manifest + SORT_DONE_SUFFIX)
+    return planned
+
+def manifest_pending(manifest):
+    """Checks if the manifest has moves that were not applied yet, e.g. after a crash"""
+    done = sum(1 for _ in read_manifest(manifest + SORT_DONE_SUFFIX))
+    return any(True for _ in islice(read_manifest(manifest), done, None))
+
+def apply_sort(manifest, workers=None, batch_size=None, report=None):
+    """Stage two: applies the manifest in batches and checkpoints every applied batch,
+    so an interrupted run resumes behind the last checkpoint. The folders emptied by a batch are pruned after it.
+    Returns the number of moved files."""
+    done = sum(1 for _ in read_manifest(manifest + SORT_DONE_SUFFIX))
+    base = os.path.dirname(manifest)
+    executor = MoveExecutor(base, workers, report=report)
+    pending = islice(read_manifest(manifest), done, None)
+    moved = 0
+    with open(manifest + SORT_DONE_SUFFIX, "a", encoding="utf-8") as checkpoint:
+        while True:
+            batch = list(islice(pending, batch_size or SORT_BATCH_SIZE))
+            if not batch:
+                return moved
+            applied = executor.apply(batch)
+            moved += write_moves(checkpoint, applied)
+            start = time.monotonic()
+            prune_folders((os.path.dirname(source) for source, destination in applied if destination), base)
+            executor.report.timed("cleanup", start)
+
+def undo_sort(manifest):
+    """Moves the files of the applied manifest back to their places and returns their number"""
+    applied = list(read_manifest(manifest + SORT_DONE_SUFFIX))
+    undone = 0
+    folders = set()
+    for source, destination, _ in reversed(applied):
+        if destination and os.path.exists(destination) and not os.path.exists(source):
+            os.makedirs(os.path.dirname(source), exist_ok=True)
+            move_file(destination, source)
+            folders.add(os.path.dirname(destination))
+            undone += 1
+    for folder in folders:
+        if not os.listdir(folder):
+            os.rmdir(folder)
+    for file_name in (manifest, manifest + SORT_DONE_SUFFIX):
+        if os.path.exists(file_name):
+            os.remove(file_name)
+    return undone
+
+def load_sort_state(path):
+    """Returns {folder: [mtime_ns, subfolder names]} saved by the previous incremental run"""
+    try:
+        with open(os.path.join(path, SORT_STATE), encoding="utf-8") as fn:
+            return json.load(fn)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_sort_state(path, state):
+    """The state file is rewritten in place, so the mtime of the folder stays the same.
+    A state damaged by a crash only makes the next run scan everything again."""
+    with open(os.path.join(path, SORT_STATE), "w", encoding="utf-8") as fn:
+        json.dump(state, fn)
+
+def incremental_sort(path, workers=None, report=None):
+    """Sorts only the folders changed since the previous incremental run and returns the number of moved files"""
+    state = load_sort_state(path)
+    new_state = {}
+    executor = MoveExecutor(path, workers, report=report)
+    moved = executor.run(walk_files(path, state, new_state, executor.report))
+    save_sort_state(path, new_state)
+    return moved
+
+def watch_files(path, interval=None, workers=None, rounds=None):
+    """Polls the folder and sorts new files as they arrive until the user interrupts it
+    or, if rounds is given, for that many polls. Returns the number of moved files."""
+    global base_path
+    base_path = path
+    print(f"Watching the {path} catalog. Press Ctrl+C to stop.")
+    moved = 0
+    try:
+        for polls in count(1):
+            report = SortReport()
+            sorted_now = incremental_sort(path, workers, report)
+            if sorted_now:
+                moved += sorted_now
+                log(report)
+            if rounds and polls >= rounds:
+                break
+            time.sleep(interval or SORT_WATCH_INTERVAL)
+    except KeyboardInterrupt:
+        print("Watching has been stopped.")
+    return moved
+
+def planned_moves(path, report=None):
+    """Yields the (source, destination, link target) moves a sorting of the folder would make, changing nothing"""
+    executor = MoveExecutor(path, report=report)
+    return executor.plan(plan_moves(path, report=executor.report))
+
+def sort_files_entry_point(path, workers=None, dry_run=False, manifest=None, incremental=False,
+                           report_file=None, listing=None):
+    """Plans the moves into the manifest and applies it. An unfinished manifest of an interrupted run
+    is resumed instead of planning again. A dry run only prints the plan and changes nothing.
+    The incremental mode skips the folders unchanged since its previous run.
+    Prints the summary of the run and returns its SortReport, which is also saved as JSON into report_file
+    and lists every moved file in the listing file if they are given."""
+    if not os.path.exists(path):
+        print('Wrong path!')
+        return
+    global base_path
+    base_path = path
+    report = SortReport(listing or os.environ.get("PERSONAL_MANAGER_SORT_LISTING"))
+    try:
+        if incremental:
+            incremental_sort(path, workers, report)
+        elif dry_run:
+            for source, destination, link in planned_moves(path, report):
+                print(f"{source} -> {destination}" + (f" (duplicate of {link})" if link else ""))
+            return report
+        else:
+            manifest = manifest or os.path.join(path, SORT_MANIFEST)
+            if manifest_pending(manifest):
+                print(f"Resuming the interrupted sorting from \"{manifest}\"")
+            else:
+                plan_sort(path, manifest, report)
+            apply_sort(manifest, workers, report=report)
+    finally:
+        report.close()
+    report_file = report_file or os.environ.get("PERSONAL_MANAGER_SORT_REPORT")
+    if report_file:
+        report.save(report_file)
+    log(report)
+    return report
+
+def sort_files_mode(path, mode="sort", workers=None):
+    """Runs one of SORT_MODES on the folder: sorts it, prints the plan of a dry run, sorts only the folders
+    changed since the previous incremental run, moves the files of the last sorting back or watches the folder"""
+    if not os.path.isdir(path):
+        print('Wrong path!')
+        return
+    if mode == "undo":
+        manifest = os.path.join(path, SORT_MANIFEST)
+        if not os.path.exists(manifest + SORT_DONE_SUFFIX):
+            print(f"There is no sorting to undo in the {path} catalog.")
+            return
+        print(f"{undo_sort(manifest)} files have been moved back.")
+    elif mode == "watch":
+        watch_files(path, workers=workers)
+    else:
+        return sort_files_entry_point(path, workers, dry_run=mode == "dry run", incremental=mode == "incremental")
 
 
 class InvalidPhoneNumber(Exception):
@@ -99,12 +799,30 @@ class InvalidEmailAddress(Exception):
 
 class Field:
     """Field class is a parent for all fields in Record class"""
+    __slots__ = ("_value",)
+
     def __init__(self, value):
         self.value = value
 
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+
+    def __setstate__(self, state) -> None:
+        """Restores fields pickled with __dict__ by the earlier versions as well as slotted ones"""
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **state[1]}
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
 
 class Name(Field):
     """Name class for storage name's field"""
+    __slots__ = ()
 
     @property
     def value(self):
@@ -117,6 +835,7 @@ class Name(Field):
 
 class Phone(Field):
     """Phone class for storage phone's field"""
+    __slots__ = ()
 
     @property
     def value(self):
@@ -135,6 +854,7 @@ class Phone(Field):
 
 class Email(Field):
     """Email class for storage email's field"""
+    __slots__ = ()
 
     @property
     def value(self):
@@ -156,7 +876,8 @@ class Email(Field):
 
 
 class Tag(Field):
-    """Tag class for storage tag's field"""
+    """Tag class for storage tag's field, equal tags share one interned string"""
+    __slots__ = ()
 
     @property
     def value(self):
@@ -164,11 +885,17 @@ class Tag(Field):
 
     @value.setter
     def value(self, value):
-        self._value = value
+        self._value = sys.intern(value)
+
+    def __setstate__(self, state) -> None:
+        super().__setstate__(state)
+        self._value = sys.intern(self._value)
 
 
 class Note(Field):
     """Note class for storage note's field"""
+    __slots__ = ("_created_at", "tag")
+
     def __init__(self, value, tags: Optional[List[str]] = None):
         super().__init__(value)
         self._created_at = datetime.today()
@@ -187,6 +914,7 @@ class Note(Field):
 
 class Address(Field):
     """Address class for storage address's field"""
+    __slots__ = ()
 
     @property
     def value(self):
@@ -201,19 +929,37 @@ class Address(Field):
 
 
 class Birthday(Field):
-    """Birthday class for storage birthday's field"""
+    """Birthday class for storage birthday's field as a date ordinal, 0 if the birthday is not set"""
+    __slots__ = ()
 
     @property
     def value(self):
-        return self._value
+        return date.fromordinal(self._value).strftime("%d.%m.%Y") if self._value else ''
 
     @value.setter
     def value(self, value):
         try:
-            self._value = datetime.strptime(value, "%d.%m.%Y").strftime("%d.%m.%Y")
+            self._value = self.parse(value)
         except ValueError:
             print(f" \"{value}\" --> Incorrect input format. Record can’t be made.")
-            self._value = ''
+            self._value = 0
+
+    @property
+    def date(self) -> Optional[date]:
+        return date.fromordinal(self._value) if self._value else None
+
+    @staticmethod
+    def parse(value: str) -> int:
+        """Returns the date ordinal of the DD.MM.YYYY birthday, raises ValueError if it is not valid"""
+        matched = BIRTHDAY_PATTERN.fullmatch(value)
+        if not matched:
+            raise ValueError(f"The birthday \"{value}\" is not in the DD.MM.YYYY format")
+        return date(int(matched[3]), int(matched[2]), int(matched[1])).toordinal()
+
+    def __setstate__(self, state) -> None:
+        super().__setstate__(state)
+        if isinstance(self._value, str):
+            self._value = datetime.strptime(self._value, "%d.%m.%Y").toordinal() if self._value else 0
 
     def __str__(self) -> str:
         return self.value
@@ -221,7 +967,11 @@ class Birthday(Field):
 
 class Record:
     """Record class responsible for the logic of adding/removing/editing fields
-    Only one name but many phone numbers"""
+    Only one name but many phone numbers. The text of the record is rendered once and kept in _rendered
+    until a field is set or changed by the methods of the record or the record is stored by the address book."""
+    __slots__ = ("name", "phone", "address", "email", "birthday", "note", "_birthday_after_note", "_rendered")
+    FIELDS = ("name", "phone", "address", "email", "birthday", "note")
+    FIELDS_BIRTHDAY_LAST = ("name", "phone", "address", "email", "note", "birthday")
 
     def __init__(self, name: str, phone: Optional[List[str]] = None,\
         birthday: Optional[str] = None, address: Optional[List[str]] = None,\
@@ -258,12 +1008,9 @@ class Record:
     def days_to_birthday(self) -> str:
         """Returns how many days left till next birthday"""
 
-        if self.birthday.value:
-            current_date = datetime.today().date()
-            birthday = datetime.strptime(self.birthday.value, "%d.%m.%Y").replace(year=current_date.year).date()
-            if birthday < current_date:
-                birthday = birthday.replace(year=birthday.year + 1)
-            days = (birthday - current_date).days
+        key = birthday_key(self)
+        if key:
+            days = days_until_birthday(key, date.today())
             return f"{days} days left till next birthday"
         return ""
 
@@ -272,6 +1019,7 @@ class Record:
         if not index:
             try:
                 self.phone.append(Phone(phone_number))
+                self._rendered = None
             except InvalidPhoneNumber:
                 print(f"The phone number {phone_number} is invalid")
 
@@ -279,20 +1027,50 @@ class Record:
         index = self.get_phone_index(phone)
         if index:
             self.phone.pop(index)
+            self._rendered = None
 
     def edit_phone(self, old_phone: str, new_phone: str) -> None:
         index = self.get_phone_index(old_phone)
         if index and not self.get_phone_index(new_phone):
             try:
                 self.phone[index] = Phone(new_phone)
+                self._rendered = None
             except InvalidPhoneNumber:
                 print(f"The phone number {new_phone} is invalid")
         else:
             print(f"Old phone \"{old_phone}\" not found or new phone \"{new_phone}\" is already exists")
 
+    def __setattr__(self, name: str, value) -> None:
+        """Remembers a birthday added after the notes to print the fields in the order they were added"""
+        if name == "birthday" and hasattr(self, "note") and not hasattr(self, "birthday"):
+            object.__setattr__(self, "_birthday_after_note", True)
+        if name != "_rendered":
+            object.__setattr__(self, "_rendered", None)
+        object.__setattr__(self, name, value)
+
+    def __getstate__(self):
+        """Slotted state without the render cache, it is not worth storing in snapshots and journals"""
+        return None, {name: getattr(self, name) for name in self.__slots__ if name != "_rendered" and hasattr(self, name)}
+
+    def __setstate__(self, state) -> None:
+        """Restores records pickled with __dict__ by the earlier versions as well as slotted ones"""
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **state[1]}
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def __str__(self) -> str:
+        rendered = getattr(self, "_rendered", None)
+        if rendered is None:
+            rendered = self._rendered = self._render()
+        return rendered
+
+    def _render(self) -> str:
         result = []
-        for name, obj in self.__dict__.items():
+        for name in self.FIELDS_BIRTHDAY_LAST if hasattr(self, "_birthday_after_note") else self.FIELDS:
+            if not hasattr(self, name):
+                continue
+            obj = getattr(self, name)
             try:
                 result.append(f"{name.upper():<10}: {obj.value}")
             except AttributeError:
@@ -300,10 +1078,1333 @@ class Record:
                     result.append(f"{name.upper():<10}: {val}")
         return "\n".join(result)
 
+    def copy(self) -> "Record":
+        """A deep copy to edit, the records stored in the address book are never changed in place"""
+        return pickle.loads(pickle.dumps(self, pickle.HIGHEST_PROTOCOL))
+
+    def to_dict(self) -> Dict[str, object]:
+        """Plain values of the fields, e.g. for the structured output of the batch mode"""
+        birthday = getattr(self, "birthday", None)
+        return {"name": self.name.value, "phones": [phone.value for phone in self.phone],
+                "birthday": birthday.value if birthday else "",
+                "addresses": [address.value for address in self.address], "emails": [email.value for email in self.email],
+                "notes": [{"note": note.value, "tags": [tag.value for tag in note.tag],
+                           "created_at": note._created_at.isoformat()} for note in self.note]}
+
+
+def birthday_key(record: Record) -> Optional[int]:
+    """Returns the day of the year of the record's birthday as MMDD number or None if it is not set"""
+    birthday = getattr(record, "birthday", None)
+    day = birthday.date if birthday else None
+    return day.month * 100 + day.day if day else None
+
+
+def days_until_birthday(key: int, today: date) -> int:
+    """Returns how many days are left from today till the birthday with MMDD key.
+    The 29th of February is celebrated on the 1st of March in non-leap years."""
+    month, day = divmod(key, 100)
+    for year in (today.year, today.year + 1):
+        try:
+            birthday = date(year, month, day)
+        except ValueError:
+            birthday = date(year, 3, 1)
+        if birthday >= today:
+            break
+    return (birthday - today).days
+
+
+def today_key(today: date) -> int:
+    """Returns the MMDD key of the first birthday celebrated today, 229 on the 1st of March in non-leap years
+    as in days_until_birthday"""
+    if today.month == 3 and today.day == 1 and (today - timedelta(days=1)).day == 28:
+        return 229
+    return today.month * 100 + today.day
+
+
+class BirthdayIndex:
+    """Names of contacts sorted by the day of the year (MMDD) of their birthdays"""
+
+    def __init__(self) -> None:
+        self._entries: List[Tuple[int, str]] = []
+        self._keys: Dict[str, int] = {}
+
+    def add(self, name: str, record: Record) -> None:
+        key = birthday_key(record)
+        if key:
+            insort(self._entries, (key, name))
+            self._keys[name] = key
+
+    def remove(self, name: str) -> None:
+        key = self._keys.pop(name, None)
+        if key:
+            del self._entries[bisect_left(self._entries, (key, name))]
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._keys.clear()
+
+    def build(self, records: Iterable[Tuple[str, Record]]) -> None:
+        """Replaces the entries with those of all records, they are sorted once instead of inserted one by one"""
+        self.clear()
+        for name, record in records:
+            key = birthday_key(record)
+            if key:
+                self._keys[name] = key
+        self._entries = sorted((key, name) for name, key in self._keys.items())
+
+    def between(self, start: int, end: int) -> List[str]:
+        """Names with birthdays from the start to the end MMDD keys inclusive"""
+        lo = bisect_left(self._entries, (start,))
+        hi = bisect_left(self._entries, (end + 1,))
+        return [name for _, name in self._entries[lo:hi]]
+
+    def upcoming(self, today: date, days: int) -> List[str]:
+        """Names with birthdays in the next days starting from today, the nearest first"""
+        if days < 0:
+            return []
+        end = today + timedelta(days=days)
+        start_key, end_key = today_key(today), end.month * 100 + end.day
+        if days >= 365:
+            return self.between(start_key, 1231) + self.between(101, start_key - 1)
+        if end.year > today.year:
+            return self.between(start_key, 1231) + self.between(101, end_key)
+        return self.between(start_key, end_key)
+
+    def iter_from(self, start: int, after: Optional[Tuple[int, str]] = None) -> Iterator[Tuple[int, str]]:
+        """Yields (MMDD, name) entries in the order of the year starting from the start key
+        and wrapping around the new year. Iteration resumes behind the after entry if it is given."""
+        split = bisect_left(self._entries, (start,))
+        if after is None:
+            yield from islice(self._entries, split, None)
+            yield from islice(self._entries, 0, split)
+        elif after[0] >= start:
+            yield from islice(self._entries, bisect_right(self._entries, after), None)
+            yield from islice(self._entries, 0, split)
+        else:
+            yield from islice(self._entries, bisect_right(self._entries, after), split)
+
+    def days_to_birthday(self, name: str, today: date) -> Optional[int]:
+        key = self._keys.get(name)
+        return days_until_birthday(key, today) if key else None
+
+
+class SubstringIndex:
+    """Maps the trigrams of the indexed values to sorted lists of the names of contacts.
+    Values are padded with END characters, so a query of one or two characters is the start of the trigrams
+    containing it and is answered by the range of the sorted vocabulary of trigrams starting with it.
+    Longer queries are answered by the rarest trigram of the query and checked against the values."""
+
+    GRAM_SIZE = 3
+    END = "\0"
+
+    def __init__(self) -> None:
+        self._postings: Dict[str, List[str]] = {}
+        self._values: Dict[str, Tuple[str, ...]] = {}
+        self._vocabulary: Optional[List[str]] = None
+
+    @classmethod
+    def _grams(cls, values: Iterable[str]) -> Set[str]:
+        grams = set()
+        for value in values:
+            value += cls.END * (cls.GRAM_SIZE - 1)
+            grams.update([value[i: i + cls.GRAM_SIZE] for i in range(len(value) - cls.GRAM_SIZE + 1)])
+        return grams
+
+    def _add(self, name: str, values: Iterable[str], insert) -> None:
+        values = tuple(value for value in values if value)
+        if values:
+            self._values[name] = values
+            postings = self._postings
+            for gram in self._grams(values):
+                names = postings.get(gram)
+                if names is None:
+                    names = postings[gram] = []
+                    self._vocabulary = None
+                insert(names, name)
+
+    def add(self, name: str, values: Iterable[str]) -> None:
+        self._add(name, values, insort)
+
+    def remove(self, name: str) -> None:
+        for gram in self._grams(self._values.pop(name, ())):
+            names = self._postings[gram]
+            del names[bisect_left(names, name)]
+            if not names:
+                del self._postings[gram]
+                self._vocabulary = None
+
+    def clear(self) -> None:
+        self._postings.clear()
+        self._values.clear()
+        self._vocabulary = None
+
+    def build(self, items: Iterable[Tuple[str, Iterable[str]]]) -> None:
+        """Replaces the index with the (name, values) items, every posting list is sorted once at the end"""
+        self.clear()
+        for name, values in items:
+            self._add(name, values, list.append)
+        for names in self._postings.values():
+            names.sort()
+
+    def find(self, query: str) -> Set[str]:
+        """Names of contacts that have the query as a substring of one of their values"""
+        if not query:
+            return set(self._values)
+        if len(query) < self.GRAM_SIZE:
+            if self._vocabulary is None:
+                self._vocabulary = sorted(self._postings)
+            found = set()
+            for gram in islice(self._vocabulary, bisect_left(self._vocabulary, query), None):
+                if not gram.startswith(query):
+                    break
+                found.update(self._postings[gram])
+            return found
+        grams = [query[i: i + self.GRAM_SIZE] for i in range(len(query) - self.GRAM_SIZE + 1)]
+        candidates = min((self._postings.get(gram, ()) for gram in grams), key=len)
+        return {name for name in candidates if any(query in value for value in self._values[name])}
+
+
+class ValueIndex:
+    """Sorted names of contacts for every distinct value of a field whose values repeat, like birthdays.
+    A substring query scans the distinct values, not the contacts."""
+
+    def __init__(self) -> None:
+        self._names: Dict[str, List[str]] = {}
+        self._values: Dict[str, Tuple[str, ...]] = {}
+
+    def _add(self, name: str, values: Iterable[str], insert) -> None:
+        values = tuple({value for value in values if value})
+        if values:
+            self._values[name] = values
+            for value in values:
+                insert(self._names.setdefault(value, []), name)
+
+    def add(self, name: str, values: Iterable[str]) -> None:
+        self._add(name, values, insort)
+
+    def remove(self, name: str) -> None:
+        for value in self._values.pop(name, ()):
+            names = self._names[value]
+            del names[bisect_left(names, name)]
+            if not names:
+                del self._names[value]
+
+    def clear(self) -> None:
+        self._names.clear()
+        self._values.clear()
+
+    def build(self, items: Iterable[Tuple[str, Iterable[str]]]) -> None:
+        self.clear()
+        for name, values in items:
+            self._add(name, values, list.append)
+        for names in self._names.values():
+            names.sort()
+
+    def get(self, value: str) -> Set[str]:
+        """Names of contacts with the value"""
+        return set(self._names.get(value, ()))
+
+    def find(self, query: str) -> Set[str]:
+        """Names of contacts with a value containing the query"""
+        return {name for value, names in self._names.items() if query in value for name in names}
+
+
+class PrefixIndex:
+    """Sorted (value, name) pairs for prefix lookups by binary search"""
+
+    def __init__(self) -> None:
+        self._entries: List[Tuple[str, str]] = []
+        self._values: Dict[str, Tuple[str, ...]] = {}
+
+    def add(self, name: str, values: Iterable[str]) -> None:
+        self._values[name] = tuple(set(values))
+        for value in self._values[name]:
+            insort(self._entries, (value, name))
+
+    def remove(self, name: str) -> None:
+        for value in self._values.pop(name, ()):
+            del self._entries[bisect_left(self._entries, (value, name))]
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._values.clear()
+
+    def build(self, items: Iterable[Tuple[str, Iterable[str]]]) -> None:
+        """Replaces the entries with the (name, values) items, they are sorted once instead of inserted one by one"""
+        self.clear()
+        for name, values in items:
+            self._values[name] = tuple(set(values))
+        self._entries = sorted((value, name) for name, values in self._values.items() for value in values)
+
+    def iter_after(self, value: Optional[str] = None) -> Iterator[Tuple[str, str]]:
+        """Yields sorted (value, name) entries that follow the value, or all of them if it is None"""
+        start = bisect_right(self._entries, (value, chr(0x10ffff))) if value is not None else 0
+        return islice(self._entries, start, None)
+
+    def find(self, prefix: str) -> Set[str]:
+        """Names of contacts that have a value starting with the prefix"""
+        found = set()
+        for value, name in islice(self._entries, bisect_left(self._entries, (prefix,)), None):
+            if not value.startswith(prefix):
+                break
+            found.add(name)
+        return found
+
+
+class NameIndex(PrefixIndex):
+    """Sorted names of contacts"""
+
+    def add(self, name: str, record: Record) -> None:
+        super().add(name, [name])
+
+    def build(self, records: Iterable[Tuple[str, Record]]) -> None:
+        super().build((name, [name]) for name, _ in records)
+
+
+class SearchIndex:
+    """Inverted index of the fields used by the contact search: phone prefixes,
+    substrings of names, emails and birthdays and whole note texts"""
+
+    def __init__(self) -> None:
+        self.phones = PrefixIndex()
+        self.names = SubstringIndex()
+        self.emails = SubstringIndex()
+        self.birthdays = ValueIndex()
+        self.notes = ValueIndex()
+
+    @staticmethod
+    def _birthdays(record: Record) -> List[str]:
+        birthday = getattr(record, "birthday", None)
+        return [birthday.value] if birthday else []
+
+    def _fields(self) -> Tuple:
+        return self.phones, self.names, self.emails, self.birthdays, self.notes
+
+    def add(self, name: str, record: Record) -> None:
+        self.phones.add(name, [phone.value for phone in record.phone])
+        self.names.add(name, [name])
+        self.emails.add(name, [email.value for email in record.email])
+        self.birthdays.add(name, self._birthdays(record))
+        self.notes.add(name, [note.value for note in record.note])
+
+    def remove(self, name: str) -> None:
+        for index in self._fields():
+            index.remove(name)
+
+    def clear(self) -> None:
+        for index in self._fields():
+            index.clear()
+
+    def build(self, records: Collection[Tuple[str, Record]]) -> None:
+        """Builds every field index from all records at once, the records are iterated once per field"""
+        self.phones.build((name, [phone.value for phone in record.phone]) for name, record in records)
+        self.names.build((name, [name]) for name, _ in records)
+        self.emails.build((name, [email.value for email in record.email]) for name, record in records)
+        self.birthdays.build((name, self._birthdays(record)) for name, record in records)
+        self.notes.build((name, [note.value for note in record.note]) for name, record in records)
+
+    def find(self, search_info: str) -> Set[str]:
+        """Names of contacts whose phone starts with the search string, whose name contains it capitalized,
+        whose emails or birthday contain it or who have a note equal to it"""
+        return self.phones.find(search_info) | self.names.find(search_info.capitalize()) | \
+            self.emails.find(search_info) | self.birthdays.find(search_info) | self.notes.get(search_info)
+
+
+class TrigramIndex:
+    """Trigrams of the lowercased names and emails of contacts for the fuzzy lookup, every trigram maps
+    to the sorted list of the keys of the values containing it.
+    A value with a trigram similarity of at least the threshold shares at least threshold * n of the n trigrams
+    of the query, so it is found in the n - that + 1 rarest posting lists. Only those are scanned,
+    the rest of the lists are just probed for the found values by binary search."""
+
+    def __init__(self) -> None:
+        self._postings: Dict[str, List[str]] = {}
+        self._sizes: Dict[str, int] = {}
+        self._keys: Dict[str, Tuple[str, ...]] = {}
+
+    @staticmethod
+    def grams(value: str) -> Set[str]:
+        value = f"  {value.lower()} "
+        return {value[i: i + 3] for i in range(len(value) - 2)}
+
+    @staticmethod
+    def similarity(grams: Set[str], other: Set[str]) -> float:
+        shared = len(grams & other)
+        return shared / (len(grams) + len(other) - shared)
+
+    @staticmethod
+    def _contains(keys: List[str], key: str) -> bool:
+        index = bisect_left(keys, key)
+        return index < len(keys) and keys[index] == key
+
+    def _add(self, name: str, record: Record, insert) -> None:
+        """The name is indexed under its own key and every email under "name\0email" """
+        keys = self._keys[name] = (name,) + tuple(f"{name}\0{email.value}" for email in record.email)
+        for key, value in zip(keys, [name] + [email.value for email in record.email]):
+            grams = self.grams(value)
+            self._sizes[key] = len(grams)
+            for gram in grams:
+                insert(self._postings.setdefault(gram, []), key)
+
+    def add(self, name: str, record: Record) -> None:
+        self._add(name, record, insort)
+
+    def remove(self, name: str) -> None:
+        for key in self._keys.pop(name, ()):
+            del self._sizes[key]
+            for gram in self.grams(key.partition("\0")[2] or key):
+                keys = self._postings[gram]
+                del keys[bisect_left(keys, key)]
+                if not keys:
+                    del self._postings[gram]
+
+    def clear(self) -> None:
+        for index in (self._postings, self._sizes, self._keys):
+            index.clear()
+
+    def build(self, records: Iterable[Tuple[str, Record]]) -> None:
+        """Replaces the index with the one of all records, every posting list is sorted once at the end"""
+        self.clear()
+        for name, record in records:
+            self._add(name, record, list.append)
+        for keys in self._postings.values():
+            keys.sort()
+
+    def similar(self, query: str, limit: int = FUZZY_LIMIT, threshold: float = FUZZY_THRESHOLD) -> List[str]:
+        """Names of the contacts whose name or one of the emails is the most similar to the query, the closest first"""
+        grams = self.grams(query)
+        postings = sorted((self._postings.get(gram, []) for gram in grams), key=len)
+        scanned = len(grams) - max(1, math.ceil(threshold * len(grams))) + 1
+        counts = Counter()
+        for keys in postings[:scanned]:
+            counts.update(keys)
+        rest = postings[scanned:]
+        best: Dict[str, float] = {}
+        for key, shared in counts.items():
+            size = self._sizes[key]
+            if shared + len(rest) < threshold * (len(grams) + size - shared - len(rest)):
+                continue
+            shared += sum(self._contains(keys, key) for keys in rest)
+            score = shared / (len(grams) + size - shared)
+            name = key.partition("\0")[0]
+            if score >= threshold and score > best.get(name, 0.0):
+                best[name] = score
+        return [name for _, name in nlargest(limit, ((score, name) for name, score in best.items()))]
+
+
+class TagIndex:
+    """Posting lists of notes for every tag value, each list sorted from the newest note to the oldest"""
+
+    def __init__(self) -> None:
+        self._postings: Dict[str, List[Tuple[float, int]]] = {}
+        self._notes: Dict[int, Tuple[str, Note]] = {}
+        self._keys: Dict[str, List[Tuple[str, Tuple[float, int]]]] = {}
+        self._counter = count()
+
+    def _add(self, name: str, record: Record, insert) -> None:
+        keys = self._keys.setdefault(name, [])
+        for note in record.note:
+            key = (-note._created_at.timestamp(), next(self._counter))
+            self._notes[key[1]] = (name, note)
+            for tag in {tag.value for tag in note.tag}:
+                insert(self._postings.setdefault(tag, []), key)
+                keys.append((tag, key))
+
+    def add(self, name: str, record: Record) -> None:
+        self._add(name, record, insort)
+
+    def remove(self, name: str) -> None:
+        for tag, key in self._keys.pop(name, ()):
+            postings = self._postings[tag]
+            del postings[bisect_left(postings, key)]
+            if not postings:
+                del self._postings[tag]
+            self._notes.pop(key[1], None)
+
+    def clear(self) -> None:
+        self._postings.clear()
+        self._notes.clear()
+        self._keys.clear()
+
+    def build(self, records: Iterable[Tuple[str, Record]]) -> None:
+        """Replaces the index with the one of all records, every posting list is sorted once at the end"""
+        self.clear()
+        for name, record in records:
+            self._add(name, record, list.append)
+        for postings in self._postings.values():
+            postings.sort()
+
+    def notes(self, tags: List[str], match_all: bool = False) -> Iterator[Tuple[str, Note]]:
+        """Yields (name, note) pairs for notes with any or with all of the tags, the newest note first"""
+        postings = [self._postings.get(tag, []) for tag in set(tags)]
+        if not postings:
+            return
+        if match_all:
+            wanted = set(tags)
+            for key in min(postings, key=len):
+                name, note = self._notes[key[1]]
+                if wanted.issubset(tag.value for tag in note.tag):
+                    yield name, note
+        else:
+            previous = None
+            for key in merge(*postings):
+                if key != previous:
+                    yield self._notes[key[1]]
+                previous = key
+
+
+class NoteIndex:
+    """Inverted index of the words of notes for the ranked note search. Every word maps to the sorted keys
+    of the notes containing it and every note keeps the sequence of its words, which gives the frequencies
+    and the phrase positions of the notes being scored. Notes are ranked by BM25 with the constants and the idf of the SQLite FTS5 bm25(), so both backends agree.
+    Query items are words, prefixes ending with "*" and "quoted phrases", a note matching any of them is found."""
+
+    TOKEN = re.compile(r"[^\W_]+")
+    QUERY = re.compile(r'"([^"]*)"(\s*\*)?|(\S+)')
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self) -> None:
+        self._postings: Dict[str, List[int]] = {}
+        self._notes: Dict[int, Tuple[str, Note]] = {}
+        self._tokens: Dict[int, Tuple[str, ...]] = {}
+        self._keys: Dict[str, List[int]] = {}
+        self._total = 0
+        self._vocabulary: Optional[List[str]] = None
+        self._counter = count()
+
+    @classmethod
+    def tokens(cls, text: str) -> List[str]:
+        return cls.TOKEN.findall(text.lower())
+
+    @classmethod
+    def parse(cls, query: str) -> List[Tuple[Tuple[str, ...], bool]]:
+        """Splits the query into (tokens, prefix) items, prefix marks the last token as a prefix"""
+        items = []
+        for phrase, phrase_prefix, word in cls.QUERY.findall(query):
+            prefix = bool(phrase_prefix) or word.endswith("*")
+            tokens = tuple(cls.tokens(phrase or word))
+            if tokens:
+                items.append((tokens, prefix))
+        return items
+
+    def add(self, name: str, record: Record) -> None:
+        """New notes get growing keys, so appending them keeps the posting lists sorted"""
+        keys = self._keys.setdefault(name, [])
+        for note in record.note:
+            key = next(self._counter)
+            tokens = self._tokens[key] = tuple(map(sys.intern, self.tokens(note.value)))
+            self._notes[key] = (name, note)
+            self._total += len(tokens)
+            keys.append(key)
+            for token in set(tokens):
+                postings = self._postings.get(token)
+                if postings is None:
+                    postings = self._postings[token] = []
+                    self._vocabulary = None
+                postings.append(key)
+
+    def remove(self, name: str) -> None:
+        for key in self._keys.pop(name, ()):
+            del self._notes[key]
+            tokens = self._tokens.pop(key)
+            self._total -= len(tokens)
+            for token in set(tokens):
+                postings = self._postings[token]
+                del postings[bisect_left(postings, key)]
+                if not postings:
+                    del self._postings[token]
+                    self._vocabulary = None
+
+    def clear(self) -> None:
+        for index in (self._postings, self._notes, self._tokens, self._keys):
+            index.clear()
+        self._total = 0
+        self._vocabulary = None
+
+    def build(self, records: Iterable[Tuple[str, Record]]) -> None:
+        self.clear()
+        for name, record in records:
+            self.add(name, record)
+
+    def _expand(self, prefix: str) -> Iterator[str]:
+        """Indexed words starting with the prefix, the sorted vocabulary is rebuilt after words come or go"""
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self._postings)
+        for token in islice(self._vocabulary, bisect_left(self._vocabulary, prefix), None):
+            if not token.startswith(prefix):
+                break
+            yield token
+
+    def _frequencies(self, tokens: Tuple[str, ...], prefix: bool) -> Dict[int, int]:
+        """Number of occurrences of the word, prefix or phrase in every note containing it"""
+        words = [tuple(self._expand(token)) if prefix and i == len(tokens) - 1 else (token,)
+                 for i, token in enumerate(tokens)]
+        frequencies: Dict[int, int] = {}
+        if len(words) == 1:
+            for word in words[0]:
+                for key in self._postings.get(word, ()):
+                    frequencies[key] = frequencies.get(key, 0) + self._tokens[key].count(word)
+            return frequencies
+        keys = [set().union(*(self._postings.get(word, ()) for word in found)) for found in words]
+        for key in sorted(min(keys, key=len)):
+            if all(key in found for found in keys):
+                text = self._tokens[key]
+                hits = sum(all(text[start + i] in found for i, found in enumerate(words))
+                           for start in range(len(text) - len(words) + 1))
+                if hits:
+                    frequencies[key] = hits
+        return frequencies
+
+    def _accepts(self, key: int, tags: Set[str], since: Optional[datetime], until: Optional[datetime]) -> bool:
+        note = self._notes[key][1]
+        if since and note._created_at < since or until and note._created_at >= until:
+            return False
+        return not tags or tags.issubset(tag.value for tag in note.tag)
+
+    def search_notes(self, query: str, limit: int = NOTE_SEARCH_LIMIT, tags: Iterable[str] = (),
+                     since: Optional[datetime] = None, until: Optional[datetime] = None) -> List[Tuple[str, Note]]:
+        """Returns (name, note) pairs of the limit best notes for the query, with all of the tags
+        and created since and before until if they are given. Items are scored from the rarest one,
+        when the bound of the remaining items can not lift a new note into the top it only updates found notes."""
+        notes = len(self._tokens)
+        if not notes or limit <= 0:
+            return []
+        tags = set(tags)
+        average = self._total / notes or 1
+        items = []
+        for frequencies in (self._frequencies(*item) for item in self.parse(query)):
+            if frequencies:
+                idf = math.log((notes - len(frequencies) + 0.5) / (len(frequencies) + 0.5))
+                items.append((idf if idf > 0 else 1e-6, frequencies))
+        items.sort(key=lambda item: -item[0])
+        bounds = [idf * (self.K1 + 1) for idf, _ in items]
+        scores: Dict[int, float] = {}
+        for i, (idf, frequencies) in enumerate(items):
+            admit = len(scores) < limit or nlargest(limit, scores.values())[-1] < sum(bounds[i:])
+            keys = frequencies if admit or len(frequencies) < len(scores) else \
+                [key for key in scores if key in frequencies]
+            for key in keys:
+                if key not in scores:
+                    if not admit or not self._accepts(key, tags, since, until):
+                        continue
+                    scores[key] = 0.0
+                frequency = frequencies[key]
+                scores[key] += idf * frequency * (self.K1 + 1) / \
+                    (frequency + self.K1 * (1 - self.B + self.B * len(self._tokens[key]) / average))
+        return [self._notes[key] for key in nlargest(limit, scores, key=scores.get)]
+
+
+def write_snapshot(data: Dict[str, Record], filename: str) -> None:
+    """Pickles the records into a temporary file and atomically replaces the snapshot with it"""
+    tmp_filename = f"{filename}.tmp"
+    with open(tmp_filename, "wb") as fn:
+        pickle.dump(data, fn)
+        fn.flush()
+        os.fsync(fn.fileno())
+    os.replace(tmp_filename, filename)
+
+
+def compact_snapshot(filename: str, offset: int) -> None:
+    """Writes the snapshot merged with the journal entries before offset, as load_data would read them"""
+    records = {}
+    try:
+        with open(filename, 'rb') as fn:
+            records = pickle.load(fn)
+    except (FileNotFoundError, AttributeError, MemoryError, EOFError, pickle.UnpicklingError):
+        pass
+    Journal(filename).replay(records, offset)
+    write_snapshot(records, filename)
+
+
+def write_snapshot_process(filename: str, offset: int) -> None:
+    """Runs compact_snapshot in a separate process, so neither the unpickling nor the pickling holds the GIL
+    of this process. The book runs threads, which a plain os.fork would copy in whatever state they are in,
+    so the process is started by the multiprocessing "forkserver", or "spawn" where there is none. Nothing but
+    the file name and the offset is sent to it: the records it writes are rebuilt from the files."""
+    import multiprocessing
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    process = context.Process(target=compact_snapshot, args=(filename, offset), name="snapshot", daemon=True)
+    process.start()
+    process.join()
+    if process.exitcode:
+        raise OSError(f"The snapshot process of \"{filename}\" failed")
+
+
+class Journal:
+    """Append-only log of record changes made after the last snapshot of the address book.
+    Every entry is a pickled ("set", name, record) or ("del", name, None) tuple."""
+
+    def __init__(self, snapshot: str) -> None:
+        self.snapshot = str(snapshot)
+        self.filename = f"{snapshot}.journal"
+        self._lock = threading.Lock()
+
+    def size(self) -> int:
+        """Size of the journal, taken between appends so it is always the offset of a whole entry"""
+        with self._lock:
+            try:
+                return os.path.getsize(self.filename)
+            except FileNotFoundError:
+                return 0
+
+    def append(self, entries: List[Tuple[str, str, Optional[Record]]]) -> None:
+        with self._lock, open(self.filename, "ab") as fn:
+            for entry in entries:
+                pickle.dump(entry, fn)
+            fn.flush()
+            os.fsync(fn.fileno())
+
+    def replay(self, data: Dict[str, Record], limit: Optional[int] = None) -> int:
+        """Applies the logged changes to the records and returns their number.
+        An entry cut off by a crash ends the replay and is truncated from the journal.
+        With a limit only the entries before that offset are applied and the journal is left as it is."""
+        replayed = 0
+        try:
+            with open(self.filename, "rb") as fn:
+                valid_size = 0
+                while limit is None or fn.tell() < limit:
+                    try:
+                        operation, name, record = pickle.load(fn)
+                    except EOFError:
+                        break
+                    except (pickle.UnpicklingError, ValueError, TypeError, AttributeError):
+                        print(f"The journal \"{self.filename}\" is damaged after {replayed} changes")
+                        break
+                    if operation == "set":
+                        data[name] = record
+                    else:
+                        data.pop(name, None)
+                    replayed += 1
+                    valid_size = fn.tell()
+            if limit is None and valid_size < self.size():
+                os.truncate(self.filename, valid_size)
+        except FileNotFoundError:
+            pass
+        return replayed
+
+    def cut(self, offset: int) -> None:
+        """Drops the entries before offset once they are stored in a snapshot"""
+        with self._lock:
+            try:
+                with open(self.filename, "rb") as fn:
+                    fn.seek(offset)
+                    rest = fn.read()
+            except FileNotFoundError:
+                return
+            tmp_filename = f"{self.filename}.tmp"
+            with open(tmp_filename, "wb") as fn:
+                fn.write(rest)
+                fn.flush()
+                os.fsync(fn.fileno())
+            os.replace(tmp_filename, self.filename)
+
+
+class SQLiteRecords(MutableMapping):
+    """Records of the address book stored in an SQLite database.
+    Records are unpickled on access and kept in a bounded LRU cache, the searchable fields
+    are copied into indexed side tables on every write. While deferred is set, writes are not committed
+    one by one but together by commit(). The texts of notes are also kept in the FTS5 table notes_text
+    whose rows are described by note_rows with the same ids. The name and every email of a contact are keys
+    of trigram_keys, trigrams holds the posting lists of their trigrams and trigram_counts the length of each list."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS records (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL,
+            birthday_key INTEGER, birthday TEXT, record BLOB NOT NULL);
+        CREATE INDEX IF NOT EXISTS records_birthday_key ON records (birthday_key, name);
+        CREATE TABLE IF NOT EXISTS phones (name TEXT NOT NULL, phone TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS phones_phone ON phones (phone);
+        CREATE INDEX IF NOT EXISTS phones_name ON phones (name);
+        CREATE TABLE IF NOT EXISTS emails (name TEXT NOT NULL, email TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS emails_name ON emails (name);
+        CREATE TABLE IF NOT EXISTS notes (name TEXT NOT NULL, note TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS notes_note ON notes (note);
+        CREATE INDEX IF NOT EXISTS notes_name ON notes (name);
+        CREATE TABLE IF NOT EXISTS tags (name TEXT NOT NULL, position INTEGER NOT NULL,
+            tag TEXT NOT NULL, created_at REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS tags_tag ON tags (tag, created_at);
+        CREATE INDEX IF NOT EXISTS tags_name ON tags (name);
+        CREATE TABLE IF NOT EXISTS note_rows (id INTEGER PRIMARY KEY, name TEXT NOT NULL, position INTEGER NOT NULL,
+            created_at REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS note_rows_name ON note_rows (name);
+        CREATE VIRTUAL TABLE IF NOT EXISTS notes_text USING fts5(note, tokenize="unicode61 remove_diacritics 0");
+        CREATE TABLE IF NOT EXISTS trigram_keys (id INTEGER PRIMARY KEY, name TEXT NOT NULL, size INTEGER NOT NULL);
+        CREATE INDEX IF NOT EXISTS trigram_keys_name ON trigram_keys (name);
+        CREATE TABLE IF NOT EXISTS trigrams (gram TEXT NOT NULL, key INTEGER NOT NULL, PRIMARY KEY (gram, key))
+            WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS trigrams_key ON trigrams (key);
+        CREATE TABLE IF NOT EXISTS trigram_counts (gram TEXT PRIMARY KEY, count INTEGER NOT NULL) WITHOUT ROWID;
+    """
+    SIDE_TABLES = ("phones", "emails", "notes", "tags", "note_rows", "trigram_keys")
+
+    def __init__(self, filename: str, cache_size: int = SQLITE_CACHE_SIZE) -> None:
+        import sqlite3
+        self.filename = str(filename)
+        self.connection = sqlite3.connect(self.filename, check_same_thread=False)
+        self.connection.executescript(self.SCHEMA)
+        self.cache_size = cache_size
+        self.deferred = False
+        self._cache: OrderedDict = OrderedDict()
+        if self.connection.execute("SELECT 1 FROM notes LIMIT 1").fetchone() and \
+                not self.connection.execute("SELECT 1 FROM note_rows LIMIT 1").fetchone():
+            with self.connection:
+                self._write_notes([(row[0], pickle.loads(row[1])) for row in \
+                    self.connection.execute("SELECT name, record FROM records")])
+        if self.connection.execute("SELECT 1 FROM records LIMIT 1").fetchone() and \
+                not self.connection.execute("SELECT 1 FROM trigram_keys LIMIT 1").fetchone():
+            with self.connection:
+                self._write_trigrams([(row[0], pickle.loads(row[1])) for row in \
+                    self.connection.execute("SELECT name, record FROM records")])
+
+    def __getitem__(self, name: str) -> Record:
+        record = self._cache.get(name)
+        if record is not None:
+            self._cache.move_to_end(name)
+            return record
+        row = self.connection.execute("SELECT record FROM records WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        record = pickle.loads(row[0])
+        self._remember(name, record)
+        return record
+
+    def __setitem__(self, name: str, record: Record) -> None:
+        with self._transaction():
+            self._write(name, record)
+        self._remember(name, record)
+
+    def __delitem__(self, name: str) -> None:
+        with self._transaction():
+            deleted = self.connection.execute("DELETE FROM records WHERE name = ?", (name,)).rowcount
+            self._delete_side_rows([(name,)])
+        self._cache.pop(name, None)
+        if not deleted:
+            raise KeyError(name)
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._cache or \
+            self.connection.execute("SELECT 1 FROM records WHERE name = ?", (name,)).fetchone() is not None
+
+    def __iter__(self) -> Iterator[str]:
+        for row in self.connection.execute("SELECT name FROM records ORDER BY id"):
+            yield row[0]
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def _transaction(self):
+        return nullcontext() if self.deferred else self.connection
+
+    @contextmanager
+    def atomic(self):
+        """Commits all writes of the block in one transaction, or rolls them back if it fails.
+        Inside a deferred run the writes are already committed together."""
+        if self.deferred:
+            yield
+            return
+        self.deferred = True
+        try:
+            with self.connection:
+                yield
+        finally:
+            self.deferred = False
+
+    def commit(self) -> None:
+        self.connection.commit()
+
+    def _remember(self, name: str, record: Record) -> None:
+        self._cache[name] = record
+        self._cache.move_to_end(name)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _write(self, name: str, record: Record) -> None:
+        self._write_many([(name, record)])
+
+    def _write_many(self, records: List[Tuple[str, Record]]) -> None:
+        """Writes the records and their side table rows with one statement per table"""
+        self.connection.executemany("INSERT INTO records (name, birthday_key, birthday, record) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET birthday_key = excluded.birthday_key, "
+            "birthday = excluded.birthday, record = excluded.record",
+            [(name, birthday_key(record), record.birthday.value if getattr(record, "birthday", None) else None, \
+            pickle.dumps(record)) for name, record in records])
+        self._delete_side_rows([(name,) for name, _ in records])
+        self.connection.executemany("INSERT INTO phones VALUES (?, ?)", \
+            [(name, phone.value) for name, record in records for phone in record.phone])
+        self.connection.executemany("INSERT INTO emails VALUES (?, ?)", \
+            [(name, email.value) for name, record in records for email in record.email])
+        self.connection.executemany("INSERT INTO notes VALUES (?, ?)", \
+            [(name, note.value) for name, record in records for note in record.note])
+        self.connection.executemany("INSERT INTO tags VALUES (?, ?, ?, ?)", [(name, position, tag, \
+            note._created_at.timestamp()) for name, record in records for position, note in enumerate(record.note) \
+            for tag in {tag.value for tag in note.tag}])
+        self._write_notes(records)
+        self._write_trigrams(records)
+
+    def _write_notes(self, records: List[Tuple[str, Record]]) -> None:
+        """Adds the notes of the records to notes_text and note_rows, the ids follow the largest one in use"""
+        last = self.connection.execute("SELECT COALESCE(MAX(id), 0) FROM note_rows").fetchone()[0]
+        rows = [(name, position, note) for name, record in records for position, note in enumerate(record.note)]
+        self.connection.executemany("INSERT INTO note_rows VALUES (?, ?, ?, ?)", [(last + i, name, position, \
+            note._created_at.timestamp()) for i, (name, position, note) in enumerate(rows, 1)])
+        self.connection.executemany("INSERT INTO notes_text (rowid, note) VALUES (?, ?)", \
+            [(last + i, note.value) for i, (_, _, note) in enumerate(rows, 1)])
+
+    def _write_trigrams(self, records: List[Tuple[str, Record]]) -> None:
+        """Adds the names and emails of the records to trigram_keys and their trigrams to the posting lists,
+        the ids follow the largest one in use"""
+        last = self.connection.execute("SELECT COALESCE(MAX(id), 0) FROM trigram_keys").fetchone()[0]
+        keys, rows = [], []
+        for name, record in records:
+            for value in [name] + [email.value for email in record.email]:
+                grams = TrigramIndex.grams(value)
+                last += 1
+                keys.append((last, name, len(grams)))
+                rows.extend((gram, last) for gram in grams)
+        self.connection.executemany("INSERT INTO trigram_keys VALUES (?, ?, ?)", keys)
+        self.connection.executemany("INSERT INTO trigrams VALUES (?, ?)", rows)
+        self.connection.executemany("INSERT INTO trigram_counts VALUES (?, 1) "
+            "ON CONFLICT (gram) DO UPDATE SET count = count + 1", [(gram,) for gram, _ in rows])
+
+    def _delete_side_rows(self, names: List[Tuple[str]]) -> None:
+        self.connection.executemany("DELETE FROM notes_text WHERE rowid IN (SELECT id FROM note_rows WHERE name = ?)", \
+            names)
+        keys = "SELECT id FROM trigram_keys WHERE name = ?1"
+        self.connection.executemany("UPDATE trigram_counts SET count = count - (SELECT COUNT(*) FROM trigrams "
+            f"WHERE trigrams.gram = trigram_counts.gram AND key IN ({keys})) "
+            f"WHERE gram IN (SELECT gram FROM trigrams WHERE key IN ({keys}))", names)
+        self.connection.executemany(f"DELETE FROM trigrams WHERE key IN ({keys})", names)
+        for table in self.SIDE_TABLES:
+            self.connection.executemany(f"DELETE FROM {table} WHERE name = ?", names)
+
+    def update_many(self, records: Iterable[Tuple[str, Record]]) -> int:
+        """Writes many records in one transaction, IMPORT_BATCH_SIZE records per statement, and returns their number"""
+        written = 0
+        records = iter(records)
+        with self._transaction():
+            while True:
+                batch = list(islice(records, IMPORT_BATCH_SIZE))
+                if not batch:
+                    return written
+                self._write_many(batch)
+                for name, _ in batch:
+                    self._cache.pop(name, None)
+                written += len(batch)
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class SQLiteIndex(BirthdayIndex):
+    """Serves the birthday, search, tag and name lookups of the address book
+    with queries to the indexed tables of SQLiteRecords"""
+
+    def __init__(self, records: SQLiteRecords) -> None:
+        self.records = records
+        self.connection = records.connection
+
+    def add(self, name: str, record: Record) -> None:
+        """SQLiteRecords keeps the tables up to date on every write"""
+
+    def remove(self, name: str) -> None:
+        """SQLiteRecords keeps the tables up to date on every delete"""
+
+    def clear(self) -> None:
+        """There is nothing to rebuild in memory"""
+
+    def between(self, start: int, end: int) -> List[str]:
+        return [row[0] for row in self.connection.execute("SELECT name FROM records "
+            "WHERE birthday_key BETWEEN ? AND ? ORDER BY birthday_key, name", (start, end))]
+
+    def iter_from(self, start: int, after: Optional[Tuple[int, str]] = None) -> Iterator[Tuple[int, str]]:
+        query = "SELECT birthday_key, name FROM records WHERE birthday_key IS NOT NULL AND "
+        order = " ORDER BY birthday_key, name"
+        if after is None:
+            yield from self.connection.execute(query + "birthday_key >= ?" + order, (start,))
+            yield from self.connection.execute(query + "birthday_key < ?" + order, (start,))
+        elif after[0] >= start:
+            yield from self.connection.execute(query + "(birthday_key, name) > (?, ?)" + order, after)
+            yield from self.connection.execute(query + "birthday_key < ?" + order, (start,))
+        else:
+            yield from self.connection.execute(query + "(birthday_key, name) > (?, ?) AND birthday_key < ?" \
+                + order, (*after, start))
+
+    def days_to_birthday(self, name: str, today: date) -> Optional[int]:
+        row = self.connection.execute("SELECT birthday_key FROM records WHERE name = ?", (name,)).fetchone()
+        return days_until_birthday(row[0], today) if row and row[0] else None
+
+    def find(self, search_info: str) -> Set[str]:
+        """Same matching as SearchIndex.find: phone prefixes use the phone index,
+        substrings of names, emails and birthdays are checked by SQLite without unpickling records"""
+        rows = self.connection.execute("SELECT name FROM phones WHERE phone >= ? AND phone < ? "
+            "UNION SELECT name FROM records WHERE instr(name, ?) > 0 "
+            "UNION SELECT name FROM emails WHERE instr(email, ?) > 0 "
+            "UNION SELECT name FROM records WHERE instr(birthday, ?) > 0 "
+            "UNION SELECT name FROM notes WHERE note = ?", (search_info, search_info + chr(0x10ffff), \
+            search_info.capitalize(), search_info, search_info, search_info))
+        return {row[0] for row in rows}
+
+    def notes(self, tags: List[str], match_all: bool = False) -> Iterator[Tuple[str, Note]]:
+        tags = list(set(tags))
+        if not tags:
+            return
+        having = f"HAVING COUNT(DISTINCT tag) = {len(tags)} " if match_all else ""
+        rows = self.connection.execute(f"SELECT name, position FROM tags WHERE tag IN ({', '.join('?' * len(tags))}) "
+            f"GROUP BY name, position {having}ORDER BY MAX(created_at) DESC", tags).fetchall()
+        for name, position in rows:
+            yield name, self.records[name].note[position]
+
+    def search_notes(self, query: str, limit: int = NOTE_SEARCH_LIMIT, tags: Iterable[str] = (),
+                     since: Optional[datetime] = None, until: Optional[datetime] = None) -> List[Tuple[str, Note]]:
+        """Same query items and ranking as NoteIndex.search_notes, matched and ranked by FTS5"""
+        items = NoteIndex.parse(query)
+        if not items or limit <= 0:
+            return []
+        match = " OR ".join(f"\"{' '.join(tokens)}\"{' *' if prefix else ''}" for tokens, prefix in items)
+        conditions, params = ["notes_text MATCH ?"], [match]
+        if since:
+            conditions.append("note_rows.created_at >= ?")
+            params.append(since.timestamp())
+        if until:
+            conditions.append("note_rows.created_at < ?")
+            params.append(until.timestamp())
+        tags = list(set(tags))
+        if tags:
+            conditions.append(f"(SELECT COUNT(DISTINCT tag) FROM tags WHERE tags.name = note_rows.name AND "
+                f"tags.position = note_rows.position AND tag IN ({', '.join('?' * len(tags))})) = {len(tags)}")
+            params.extend(tags)
+        rows = self.connection.execute("SELECT note_rows.name, note_rows.position FROM notes_text "
+            f"JOIN note_rows ON note_rows.id = notes_text.rowid WHERE {' AND '.join(conditions)} "
+            "ORDER BY bm25(notes_text) LIMIT ?", params + [limit]).fetchall()
+        return [(name, self.records[name].note[position]) for name, position in rows]
+
+    def iter_after(self, value: Optional[str] = None) -> Iterator[Tuple[str, str]]:
+        rows = self.connection.execute("SELECT name, name FROM records WHERE name > ? ORDER BY name", \
+            (value if value is not None else "",))
+        return iter(rows)
+
+    def similar(self, query: str, limit: int = FUZZY_LIMIT, threshold: float = FUZZY_THRESHOLD) -> List[str]:
+        """Same ranking and prefix filter as TrigramIndex.similar over the trigram tables: only the posting lists
+        of the rarest trigrams are read, the rest are probed for the found keys and the keys are scored by SQLite"""
+        grams = TrigramIndex.grams(query)
+        counts = dict(self.connection.execute("SELECT gram, count FROM trigram_counts "
+            f"WHERE gram IN ({', '.join('?' * len(grams))})", list(grams)))
+        ordered = sorted(grams, key=lambda gram: counts.get(gram, 0))
+        scanned = len(grams) - max(1, math.ceil(threshold * len(grams))) + 1
+        rare = [gram for gram in ordered[:scanned] if counts.get(gram)]
+        rest = [gram for gram in ordered[scanned:] if counts.get(gram)]
+        if not rare or limit <= 0:
+            return []
+        rows = self.connection.execute(f"""
+            WITH found AS (SELECT key, COUNT(*) AS shared FROM trigrams WHERE gram IN ({', '.join('?' * len(rare))}) GROUP BY key),
+            bounded AS (SELECT key, shared, size, name FROM found JOIN trigram_keys ON trigram_keys.id = found.key
+                WHERE shared + ? >= ? * (? + size - shared - ?)),
+            probed AS (SELECT name, size, shared + (SELECT COUNT(*) FROM trigrams
+                WHERE trigrams.key = bounded.key AND gram IN ({', '.join('?' * len(rest))})) AS shared FROM bounded),
+            scored AS (SELECT name, CAST(shared AS REAL) / (? + size - shared) AS score FROM probed)
+            SELECT name, MAX(score) AS best FROM scored WHERE score >= ? GROUP BY name
+            ORDER BY best DESC, name DESC LIMIT ?""",
+            [*rare, len(rest), threshold, len(grams), len(rest), *rest, len(grams), threshold, limit])
+        return [name for name, _ in rows]
+
+
+class ImportReport:
+    """Outcome of an import: the number of imported contacts and of rejected rows.
+    Only the first IMPORT_REPORT_ERRORS error messages are kept."""
+
+    def __init__(self) -> None:
+        self.imported = 0
+        self.errors = 0
+        self.messages: List[str] = []
+
+    def failed(self, line: int, error: Exception) -> None:
+        self.errors += 1
+        if len(self.messages) < IMPORT_REPORT_ERRORS:
+            self.messages.append(f"line {line}: {error}")
+
+    def to_dict(self) -> Dict[str, object]:
+        return {"imported": self.imported, "errors": self.errors, "messages": self.messages}
+
+    def __str__(self) -> str:
+        lines = [f"Imported {self.imported} contacts, {self.errors} rows were rejected."]
+        lines.extend(self.messages)
+        if self.errors > len(self.messages):
+            lines.append(f"... and {self.errors - len(self.messages)} more errors")
+        return "\n".join(lines)
+
+
+def contact_from_row(row: Dict) -> Record:
+    """Builds the record of an imported row checking the fields with the setters of Phone, Email and Birthday.
+    Raises ValueError describing the first invalid field."""
+    name = row.get("name", "").strip()
+    if not name:
+        raise ValueError("The name is empty")
+    phones, emails = [], []
+    for value in row.get("phones", ()):
+        try:
+            phones.append(Phone(value))
+        except InvalidPhoneNumber:
+            raise ValueError(f"The phone number \"{value}\" is invalid")
+    for value in row.get("emails", ()):
+        try:
+            emails.append(Email(value))
+        except InvalidEmailAddress:
+            raise ValueError(f"The email \"{value}\" is invalid")
+    birthday = row.get("birthday")
+    if birthday:
+        try:
+            Birthday.parse(birthday)
+        except ValueError:
+            raise ValueError(f"The birthday \"{birthday}\" is not in the DD.MM.YYYY format")
+    record = Record(name, [], birthday, row.get("addresses", []), [], [])
+    record.phone = phones
+    record.email = emails
+    record.note = [Note(note, tags) for note, tags in row.get("notes", ())]
+    return record
+
+
+def csv_join(values: Iterable[str], separator: str = ";") -> str:
+    return separator.join(value.replace("\\", "\\\\").replace(separator, "\\" + separator) for value in values)
+
+
+def csv_split(value: Optional[str], separator: str = ";", keep_empty: bool = False) -> List[str]:
+    """Splits a cell joined by csv_join, a cell without escapes is split like the lists in the prompts"""
+    if "\\" not in (value or ""):
+        items = [item.strip() for item in (value or "").split(separator)]
+        return items if keep_empty else [item for item in items if item]
+    parts = re.split(r"(?<!\\)((?:\\\\)*)" + re.escape(separator), value or "")
+    items = [re.sub(r"\\(.)", r"\1", part + suffix).strip() for part, suffix in zip(parts[::2], parts[1::2] + [""])]
+    return items if keep_empty else [item for item in items if item]
+
+
+def csv_rows(fn) -> Iterator[Tuple[int, Dict]]:
+    """Yields (line number, row) for the contacts of a CSV file with the CSV_FIELDS columns.
+    Lists are separated by ";", the tags of every note are separated by "," in the same position of the tags column."""
+    import csv
+    reader = csv.DictReader(fn)
+    for row in reader:
+        notes = csv_split(row.get("notes"))
+        tags = csv_split(row.get("tags"), keep_empty=True)
+        yield reader.line_num, {"name": row.get("name") or "", "phones": csv_split(row.get("phones")),
+            "birthday": (row.get("birthday") or "").strip(), "addresses": csv_split(row.get("addresses")),
+            "emails": csv_split(row.get("emails")),
+            "notes": [(note, csv_split(tags[i], ",") if i < len(tags) else []) for i, note in enumerate(notes)]}
+
+
+def write_csv(records: Iterable[Record], fn) -> int:
+    """Writes the records one by one as CSV rows readable by csv_rows and returns their number"""
+    import csv
+    writer = csv.writer(fn)
+    writer.writerow(CSV_FIELDS)
+    written = 0
+    for record in records:
+        birthday = getattr(record, "birthday", None)
+        writer.writerow([record.name.value, csv_join(phone.value for phone in record.phone),
+            birthday.value if birthday else "", csv_join(address.value for address in record.address),
+            csv_join(email.value for email in record.email), csv_join(note.value for note in record.note),
+            csv_join(csv_join((tag.value for tag in note.tag), ",") for note in record.note)])
+        written += 1
+    return written
+
+
+def vcard_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace(",", "\\,").replace(";", "\\;")
+
+
+def vcard_unescape(value: str) -> str:
+    return re.sub(r"\\(.)", lambda match: "\n" if match.group(1) in "nN" else match.group(1), value)
+
+
+def vcard_lines(fn) -> Iterator[Tuple[int, str]]:
+    """Yields (line number, line) of the vCard file with the folded lines joined"""
+    number, previous = 0, None
+    for position, line in enumerate(fn, 1):
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and previous is not None:
+            previous += line[1:]
+            continue
+        if previous is not None:
+            yield number, previous
+        number, previous = position, line
+    if previous is not None:
+        yield number, previous
+
+
+def vcard_rows(fn) -> Iterator[Tuple[int, Dict]]:
+    """Yields (line number of BEGIN, row) for the contacts of a vCard file. FN is the name,
+    BDAY is read as YYYY-MM-DD, YYYYMMDD or DD.MM.YYYY and the X-TAGS parameter of NOTE holds its tags."""
+    row, start = None, 0
+    for number, line in vcard_lines(fn):
+        key, _, value = line.partition(":")
+        prop, *params = key.split(";")
+        prop = prop.rsplit(".", 1)[-1].upper()
+        if prop == "BEGIN" and value.upper() == "VCARD":
+            row, start = {"name": "", "phones": [], "birthday": "", "addresses": [], "emails": [], "notes": []}, number
+        elif row is None:
+            continue
+        elif prop == "END":
+            yield start, row
+            row = None
+        elif prop == "FN":
+            row["name"] = vcard_unescape(value)
+        elif prop == "TEL":
+            row["phones"].append(value.strip())
+        elif prop == "EMAIL":
+            row["emails"].append(value.strip())
+        elif prop == "BDAY":
+            value = value.strip()
+            if re.fullmatch(r"\d{4}-?\d{2}-?\d{2}", value):
+                value = f"{value[-2:]}.{value[-4:-2] if '-' not in value else value[5:7]}.{value[:4]}"
+            row["birthday"] = value
+        elif prop == "ADR":
+            parts = [vcard_unescape(part) for part in re.split(r"(?<!\\);", value)]
+            row["addresses"].append(", ".join(part for part in parts if part))
+        elif prop == "NOTE":
+            tags = [param.partition("=")[2] for param in params if param.upper().startswith("X-TAGS=")]
+            row["notes"].append((vcard_unescape(value), batch_list(",".join(tags).split(","))))
+
+
+def write_vcard(records: Iterable[Record], fn) -> int:
+    """Writes the records one by one as vCard 3.0 contacts readable by vcard_rows and returns their number"""
+    written = 0
+    for record in records:
+        lines = ["BEGIN:VCARD", "VERSION:3.0", f"FN:{vcard_escape(record.name.value)}",
+                 f"N:{vcard_escape(record.name.value)};;;;"]
+        lines.extend(f"TEL:{phone.value}" for phone in record.phone)
+        lines.extend(f"EMAIL:{email.value}" for email in record.email)
+        birthday = getattr(record, "birthday", None)
+        if birthday and birthday.date:
+            lines.append(f"BDAY:{birthday.date.isoformat()}")
+        lines.extend(f"ADR:;;{vcard_escape(address.value)};;;;" for address in record.address)
+        for note in record.note:
+            tags = ",".join(tag.value.replace(",", "").replace(";", "").replace(":", "") for tag in note.tag)
+            lines.append(f"NOTE{';X-TAGS=' + tags if tags else ''}:{vcard_escape(note.value)}")
+        lines.append("END:VCARD")
+        fn.write("\r\n".join(lines) + "\r\n")
+        written += 1
+    return written
+
+
+def write_lines(lines: Iterable[str], output=None) -> int:
+    """Writes the lines to the output, sys.stdout by default, in chunks of about OUTPUT_BUFFER_SIZE characters
+    and returns their number. The lines are taken one by one, so a listing is never held in memory as a whole."""
+    output = output or sys.stdout
+    chunk, size, written = [], 0, 0
+    for line in lines:
+        chunk.append(line)
+        size += len(line) + 1
+        written += 1
+        if size >= OUTPUT_BUFFER_SIZE:
+            output.write("\n".join(chunk) + "\n")
+            chunk, size = [], 0
+    if chunk:
+        output.write("\n".join(chunk) + "\n")
+    output.flush()
+    return written
+
+
+@contextmanager
+def listing_output():
+    """Output of the listings: stdout, or streamed to the pager command of PERSONAL_MANAGER_PAGER (e.g. "less -R")
+    or appended to the file of PERSONAL_MANAGER_OUTPUT"""
+    pager, filename = os.environ.get("PERSONAL_MANAGER_PAGER"), os.environ.get("PERSONAL_MANAGER_OUTPUT")
+    if pager:
+        import subprocess
+        process = subprocess.Popen(pager, shell=True, stdin=subprocess.PIPE, text=True, encoding="utf-8")
+        try:
+            yield process.stdin
+        except BrokenPipeError:
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+            process.wait()
+    elif filename:
+        with open(filename, "a", encoding="utf-8") as fn:
+            yield fn
+        print(f"The listing is written to \"{filename}\"")
+    else:
+        yield sys.stdout
+
 
 class AddressBook(UserDict):
     """Add new instance of Record class in AddressBook"""
 
+    def __init__(self, *args, **kwargs) -> None:
+        self.birthday_index = BirthdayIndex()
+        self.search_index = SearchIndex()
+        self.tag_index = TagIndex()
+        self.name_index = NameIndex()
+        self.fuzzy_index = TrigramIndex()
+        self.note_index = NoteIndex()
+        self.journal: Optional[Journal] = None
+        self._changes: Dict[str, None] = {}
+        self._compactor: Optional[threading.Thread] = None
+        self._compact_lock = threading.Lock()
+        self._unsaved = 0
+        self._autosave: Optional[threading.Thread] = None
+        self._autosave_wake = threading.Event()
+        self._autosave_stop = False
+        self.autosave_changes = AUTOSAVE_CHANGES
+        super().__init__(*args, **kwargs)
+
+    def __setitem__(self, name: str, record: Record) -> None:
+        self.data[name] = record
+        self._unindex(name)
+        for index in self._indexes():
+            index.add(name, record)
+        self._changed(name)
+
+    def __delitem__(self, name: str) -> None:
+        del self.data[name]
+        self._record_removed(name)
+
+    def _indexes(self) -> Iterable:
+        """Distinct index objects of the address book, a storage backend may serve all of them with one object"""
+        return dict.fromkeys([self.birthday_index, self.search_index, self.tag_index, self.name_index, self.fuzzy_index,
+                              self.note_index])
+
+    def _unindex(self, name: str) -> None:
+        for index in self._indexes():
+            index.remove(name)
+
+    @staticmethod
+    def _editable(record: Optional[Record]) -> Optional[Record]:
+        """Returns a copy of the record to change and to store with _record_updated.
+        Stored records stay as they are until the copy is stored, so an edit abandoned halfway, e.g. by invalid input
+        or Ctrl+C, leaves the record that the indexes, the journal and the SQLite cache know about unchanged."""
+        return record.copy() if record else None
+
+    def _record_updated(self, record: Record, old_name: Optional[str] = None) -> None:
+        """Stores the added or changed record under its name and refreshes the indexes and its render cache.
+        If the record was renamed, old_name is its previous key in the address book. An SQLite book deletes
+        the old key and writes the new one in one transaction, so a crash in between can not lose the contact."""
+        record._rendered = None
+        with self.data.atomic() if isinstance(self.data, SQLiteRecords) else nullcontext():
+            if old_name and old_name != record.name.value:
+                del self[old_name]
+            self[record.name.value] = record
+
+    def _record_removed(self, name: str) -> None:
+        self._unindex(name)
+        self._changed(name)
+
+    def _changed(self, name: str) -> None:
+        """Remembers the changed name for flush_journal. A book without a journal, like an SQLite one,
+        writes its changes at once and does not track them."""
+        if self.journal:
+            self._changes[name] = None
+
+    def _rebuild_indexes(self) -> None:
+        """Builds every index from all records at once, their entries are collected and sorted once"""
+        if isinstance(self.data, SQLiteRecords):
+            return
+        for index in self._indexes():
+            index.build(self.data.items())
+
     def __get_params(self, params: Dict[str,str], msg: str = None) -> List[str]:
         msg = "Please enter the " if not msg else msg
         params_keys = list(params.keys())
@@ -328,7 +2429,7 @@ class AddressBook(UserDict):
                 "Date of birth not recorded. Please enter the correct ")).strip()
             if birthday_value:
                 new_record.birthday = Birthday(birthday_value)
-        self.data[new_record.name.value] = new_record
+        self[new_record.name.value] = new_record
 
     def _edit_name(self, record: Record) -> None:
         print(f"The following user names are registered in the address book: {[name for name in self.data]}")
@@ -336,8 +2437,8 @@ class AddressBook(UserDict):
         if new_name:
             if not self.data.get(new_name):
                 old_name = record.name.value
-                self.data[new_name] = self.data.pop(old_name)
                 record.name.value = new_name
+                self._record_updated(record, old_name)
             else:
                 print(f"The username {new_name} is already registered in the address book. Choose something else.")
         else:
@@ -351,6 +2452,7 @@ class AddressBook(UserDict):
         if new_number:
             try:
                 record.phone[index].value = new_number
+                self._record_updated(record)
             except InvalidPhoneNumber:
                 print("You entered an invalid phone number.This data is not recorded.")
         else:
@@ -361,6 +2463,7 @@ class AddressBook(UserDict):
         new_birthday = ''.join(self.__get_params({"birthday of user": ""})).strip()
         if new_birthday:
             record.birthday.value = new_birthday
+            self._record_updated(record)
         else:
             print("You have not provided a new birthday.")
 
@@ -371,6 +2474,7 @@ class AddressBook(UserDict):
         new_address = ''.join(self.__get_params({"new address": ""})).strip()
         if new_address:
             record.address[index].value = new_address
+            self._record_updated(record)
 
     def _edit_email(self, record: Record) -> None:
         option, index = pick([email.value for email in record.email], \
@@ -380,6 +2484,7 @@ class AddressBook(UserDict):
         if new_email:
             try:
                 record.email[index].value = new_email
+                self._record_updated(record)
             except InvalidEmailAddress:
                 print("You entered an invalid email address.This data is not recorded.")
         else:
@@ -390,11 +2495,12 @@ class AddressBook(UserDict):
             "Select the note for which you want to edit tags.", indicator="=>")
         base_msg = f"You have selected the note {note_option} which contains the following tags: "
         print(f"{base_msg}{[tag.value for tag in record.note[note_index].tag]}")
-        new_tags = self.__get_params({"tags": ""})
+        new_tags = list(self.__get_params({"tags": ""}))[0]
         if new_tags:
             record.note[note_index].tag = []
             for new_tag in new_tags:
                 record.note[note_index].tag.append(Tag(new_tag))
+            self._record_updated(record)
 
     def edit_record(self) -> None:
         option = pick([name for name in self.data], \
@@ -410,12 +2516,13 @@ class AddressBook(UserDict):
             option, index = pick(description_function, base_msg, indicator="=>")
             while index != len(description_function)-1:
                 print(f"You have selected an {option} option.\nLet's continue.\n{'='*60}")
+                contact = self._editable(self.data.get(contact.name.value, contact))
                 function_names[index](contact)
                 option, index = pick(description_function, base_msg, indicator="=>")
 
     def add_tags(self) -> None:
-        name_contact = ''.join(self.__get_params({"name of contact": ""})).capitalize()
-        contact = self.data.get(name_contact)
+        name_contact = self._find_name("name of contact")
+        contact = self._editable(self.data.get(name_contact)) if name_contact else None
         if contact:
             note_index = pick([note.value for note in contact.note], "Select the note where you want to add tags:", indicator="=>")[1]
             tags = contact.note[note_index].tag
@@ -428,19 +2535,19 @@ class AddressBook(UserDict):
                 tags = input(f"{base_msg}{end_msg}").split(";")
             for tag in tags:
                 contact.note[note_index].tag.append(Tag(tag))
-        else:
-            print(f"The user {name_contact} was not found in the address book.")
+            self._record_updated(contact)
 
     def del_contact(self) -> None:
-        name_contact = ''.join(self.__get_params({"contact": ""})).capitalize()
-        if self.data.get(name_contact):
-            self.data.pop(name_contact)
+        name_contact = self._find_name("contact")
+        if name_contact:
+            del self[name_contact]
             print(f"Contact {name_contact} was removed!")
-        else:
-            print(f"Contact {name_contact} not found!")
+
+    def upcoming_birthdays(self, days: int) -> List[Record]:
+        """Returns records with birthdays in the next days, the nearest birthday first"""
+        return [self.data[name] for name in self.birthday_index.upcoming(date.today(), days)]
 
     def holidays_period(self) -> None:
-        result = []
         try:
             period = int(''.join(self.__get_params({"period": ""})))
         except ValueError:
@@ -448,70 +2555,293 @@ class AddressBook(UserDict):
         else:
             if period > 365:
                 period = 365
-            day_today = datetime.now()
-            day_today_year = day_today.year
-            end_period = day_today + timedelta(days=period+1)
-            print(f"Found birthdays for {period} days period: ")
-            for name, rec in self.data.items():
-                date = datetime.strptime(rec.birthday.value, '%d.%m.%Y').replace(year=end_period.year)
-                if day_today_year < end_period.year:
-                    if day_today <= date.replace(year=day_today_year) or date <= end_period:
-                        result.append(f"{name}: {rec}")
-                else:
-                    if day_today <= date.replace(year=day_today_year) <= end_period:
-                        result.append(f"{name}: {rec}")
-            if not result:
-                result.append(f"No contacts with birthdays for this period.")
-            print('\n'.join(result))
+            with listing_output() as output:
+                output.write(f"Found birthdays for {period} days period: \n")
+                names = self.birthday_index.upcoming(date.today(), period)
+                if not write_lines((f"{name}: {self.data[name]}" for name in names), output):
+                    write_lines(["No contacts with birthdays for this period."], output)
+
+    def search_contacts(self, search_info: str) -> List[Record]:
+        """Returns records sorted by name that match the search string in the phones, name, emails, birthday or notes"""
+        return [self.data[name] for name in sorted(self.search_index.find(search_info))]
 
     def find_contact(self) -> None:
         search_info = ''.join(self.__get_params({"search info": ""}))
-        result = [f"Search results for string \"{search_info}\": "]
-        flag_found = False
-        for name, rec in self.data.items():
-            phones = [one_phone.value for one_phone in rec.phone]
-            notes = [one_note.value for one_note in rec.note]
-            emails = [one_email.value for one_email in rec.email if search_info in one_email.value]
-            if search_info in phones or \
-                    len(list(filter(lambda one_phone: one_phone.startswith(search_info), phones))) or \
-                    search_info.capitalize() in name or \
-                    search_info in rec.birthday.value or search_info in notes or emails:
-                result.append(f"{name}, {rec}")
-                flag_found = True
-        if not flag_found:
-            result.append("No information found.")
-        print('\n'.join(result))
-
-    def sort_files(self) -> str:
-        return sort_files_entry_point((''.join(self.__get_params({"path": ""}))))
-
-    def iterator(self, n: str = 1) -> List[str]:
+        names = sorted(self.search_index.find(search_info))
+        with listing_output() as output:
+            output.write(f"Search results for string \"{search_info}\": \n")
+            if not write_lines((f"{name}, {self.data[name]}" for name in names), output):
+                similar = self.similar_contacts(search_info)
+                write_lines(["No information found."] + ([f"Did you mean: {', '.join(similar)}?"] if similar else []), output)
+
+    def sort_files(self) -> Optional[SortReport]:
+        path = ''.join(self.__get_params({"path": ""})).strip()
+        mode = pick(list(SORT_MODES), "Select how to sort the files.", indicator="=>")[0]
+        workers = None
+        if mode in ("sort", "incremental", "watch"):
+            value = ''.join(self.__get_params({"number of threads moving the files (empty for the default)": ""})).strip()
+            workers = int(value) if value.isdigit() and int(value) > 0 else None
+        return sort_files_mode(path, mode, workers)
+
+    def _ordered(self, sort_by: Optional[str], cursor: Optional[tuple]) -> Iterator[Tuple[Record, object]]:
+        """Yields (record, position) pairs in the requested order starting behind the cursor"""
+        position = cursor[1] if cursor else None
+        if sort_by == "name":
+            for name, _ in self.name_index.iter_after(position):
+                yield self.data[name], name
+        elif sort_by == "birthday":
+            today = date.today()
+            start, after = position if position else (today_key(today), None)
+            for entry in self.birthday_index.iter_from(start, after):
+                yield self.data[entry[1]], (start, entry)
+        elif sort_by is None:
+            start = position or 0
+            for position, name in enumerate(islice(self.data, start, None), start + 1):
+                yield self.data[name], position
+        else:
+            raise ValueError(f"Unknown sort key \"{sort_by}\"")
+
+    def pages(self, n: int = 1, sort_by: Optional[str] = None, \
+        cursor: Optional[tuple] = None) -> Iterator[Tuple[List[Record], tuple]]:
+        """Lazily yields pages of n records with the cursor pointing behind each page.
+        Records are ordered as added, by name (sort_by="name") or by the next birthday (sort_by="birthday",
+        contacts without a birthday are skipped). Passing a saved cursor resumes the pagination from it."""
+        entries = self._ordered(sort_by, cursor)
+        while True:
+            page = list(islice(entries, n))
+            if not page:
+                return
+            yield [record for record, _ in page], (sort_by, page[-1][1])
+
+    def iterator(self, n: str = 1, sort_by: Optional[str] = None) -> Iterator[List[str]]:
         separator, enter = "="*60, "\n"
-        yield from ([f"{separator}: {enter}{rec}" for name, \
-            rec in list(self.items())[i: i + n]] for i in range(0, len(self), n))
+        for records, _ in self.pages(n, sort_by):
+            yield [f"{separator}: {enter}{rec}" for rec in records]
 
     def save_data(self, filename: str) -> None:
+        """Writes a full snapshot of the address book. The journal of this file is emptied afterwards."""
+        self.wait_compaction()
         try:
-            with open(filename, "wb") as fn:
-                pickle.dump(self.data, fn)
+            write_snapshot(self.data, filename)
+            if self.journal and self.journal.snapshot == str(filename):
+                self.journal.cut(self.journal.size())
+                self._changes.clear()
             print(f"Saving to file \"{filename}\" is successful")
         except (FileNotFoundError, AttributeError, MemoryError):
             print(f"An error occurred while saving the file \"{filename}\"")
 
+    def use_sqlite(self, filename: str, cache_size: int = SQLITE_CACHE_SIZE) -> None:
+        """Switches the address book to the SQLite database, records are loaded from it on access"""
+        self.data = SQLiteRecords(filename, cache_size)
+        self.birthday_index = self.search_index = self.tag_index = self.name_index = self.fuzzy_index = \
+            self.note_index = SQLiteIndex(self.data)
+        self.journal = None
+        self._changes.clear()
+
+    def import_pickle(self, filename: str) -> int:
+        """Imports the records of a pickle snapshot and its journal, e.g. to migrate them into SQLite"""
+        records = {}
+        if os.path.exists(filename):
+            with open(filename, 'rb') as fn:
+                records = pickle.load(fn)
+        Journal(filename).replay(records)
+        if isinstance(self.data, SQLiteRecords):
+            return self.data.update_many(records.items())
+        self.add_records(list(records.values()))
+        return len(records)
+
+    def add_records(self, records: List[Record], index: bool = True) -> None:
+        """Adds a batch of records, an SQLite book writes them in one transaction. In memory the records are stored
+        and then indexed together by _index_added, a caller adding many batches passes index=False and indexes them once."""
+        if isinstance(self.data, SQLiteRecords):
+            self.data.update_many((record.name.value, record) for record in records)
+            return
+        for record in records:
+            self.data[record.name.value] = record
+            self._changed(record.name.value)
+        if index:
+            self._index_added(records)
+
+    def _index_added(self, records: List[Record]) -> None:
+        """Indexes the records just stored in data one by one if they are fewer than 1/IMPORT_REBUILD_SHARE
+        of the book, otherwise every index is built again from all records at once"""
+        if len(records) * IMPORT_REBUILD_SHARE >= len(self.data):
+            self._rebuild_indexes()
+            return
+        for record in records:
+            self._unindex(record.name.value)
+            for index in self._indexes():
+                index.add(record.name.value, record)
+
+    def import_file(self, filename: str, batch_size: int = IMPORT_BATCH_SIZE) -> ImportReport:
+        """Streams the contacts of a CSV or vCard (VCARD_SUFFIXES) file into the book in batches.
+        Invalid rows and contacts with already registered names are reported and skipped."""
+        rows = vcard_rows if Path(filename).suffix.lower() in VCARD_SUFFIXES else csv_rows
+        report = ImportReport()
+        batch, names, added = [], set(), []
+        try:
+            with open(filename, newline="", encoding="utf-8-sig") as fn:
+                for line, row in rows(fn):
+                    try:
+                        record = contact_from_row(row)
+                        if record.name.value in names or record.name.value in self.data:
+                            raise ValueError(f"The username {record.name.value} is already registered in the address book")
+                    except ValueError as error:
+                        report.failed(line, error)
+                        continue
+                    batch.append(record)
+                    names.add(record.name.value)
+                    if len(batch) >= batch_size:
+                        self.add_records(batch, index=False)
+                        added.extend(batch)
+                        report.imported += len(batch)
+                        batch, names = [], set()
+            self.add_records(batch, index=False)
+            added.extend(batch)
+            report.imported += len(batch)
+        finally:
+            if added and not isinstance(self.data, SQLiteRecords):
+                self._index_added(added)
+        return report
+
+    def export_file(self, filename: str) -> int:
+        """Streams all contacts into a CSV or vCard (VCARD_SUFFIXES) file and returns their number"""
+        write = write_vcard if Path(filename).suffix.lower() in VCARD_SUFFIXES else write_csv
+        with open(filename, "w", newline="", encoding="utf-8") as fn:
+            return write(self.data.values(), fn)
+
+    def import_contacts(self) -> None:
+        filename = ''.join(self.__get_params({"path to the CSV or vCard file": ""})).strip()
+        try:
+            print(self.import_file(filename))
+        except OSError:
+            print(f"An error occurred while opening the file \"{filename}\"")
+
+    def export_contacts(self) -> None:
+        filename = ''.join(self.__get_params({"path to the CSV or vCard file": ""})).strip()
+        try:
+            print(f"Exported {self.export_file(filename)} contacts to \"{filename}\"")
+        except OSError:
+            print(f"An error occurred while saving the file \"{filename}\"")
+
     def load_data(self, filename: str) -> None:
+        """Loads the snapshot, replays its journal on top of it and keeps journaling changes for this file.
+        A book whose changes are all still in the journal has no snapshot yet and loads from the journal alone.
+        Files with SQLITE_SUFFIXES are opened as SQLite databases instead."""
+        if Path(filename).suffix in SQLITE_SUFFIXES:
+            import sqlite3
+            try:
+                self.use_sqlite(filename)
+                print(f"Loading from file \"{filename}\" is successful")
+            except sqlite3.Error:
+                print(f"An error occurred while opening the file \"{filename}\"")
+            return
+        self.journal = Journal(filename)
         try:
             with open(filename, 'rb') as fn:
                 self.data = pickle.load(fn)
             print(f"Loading from file \"{filename}\" is successful")
-        except (FileNotFoundError, AttributeError, MemoryError):
+        except FileNotFoundError:
+            if not self.journal.size():
+                print(f"An error occurred while opening the file \"{filename}\"")
+        except (AttributeError, MemoryError, EOFError, pickle.UnpicklingError):
             print(f"An error occurred while opening the file \"{filename}\"")
+        replayed = self.journal.replay(self.data)
+        if replayed:
+            print(f"Restored {replayed} changes from the journal \"{self.journal.filename}\"")
+        self._changes.clear()
+        self._rebuild_indexes()
+
+    def flush_journal(self) -> None:
+        """Appends the records changed since the last call to the journal.
+        A compaction is started in the background when the journal grows over JOURNAL_COMPACT_SIZE."""
+        if not self.journal or not self._changes:
+            return
+        entries = [("set", name, self.data[name]) if name in self.data else ("del", name, None) \
+            for name in self._changes]
+        self._changes.clear()
+        self.journal.append(entries)
+        self._unsaved += len(entries)
+        if self.journal.size() >= JOURNAL_COMPACT_SIZE:
+            self.compact()
+        elif self._autosave and self._unsaved >= self.autosave_changes:
+            self._autosave_wake.set()
+
+    def compact(self) -> None:
+        """Writes a new snapshot in a background thread and drops the journal entries it contains.
+        The snapshot is the old one merged with the journal up to the current offset by write_snapshot_process,
+        the entries written after that offset stay in the journal."""
+        with self._compact_lock:
+            if not self.journal or (self._compactor and self._compactor.is_alive()):
+                return
+            offset = self.journal.size()
+            self._unsaved = 0
+            self._compactor = threading.Thread(target=self._compact, args=(offset,), name="journal-compaction")
+            self._compactor.start()
+
+    def _compact(self, offset: int) -> None:
+        try:
+            write_snapshot_process(self.journal.snapshot, offset)
+            self.journal.cut(offset)
+        except (OSError, MemoryError):
+            print(f"An error occurred while compacting the journal \"{self.journal.filename}\"")
+
+    def wait_compaction(self) -> None:
+        if self._compactor:
+            self._compactor.join()
+
+    def start_autosave(self, interval: Optional[float] = None, changes: Optional[int] = None) -> None:
+        """Writes a snapshot in the background every interval seconds and after every changes journaled records,
+        so the journal stays short. Set by PERSONAL_MANAGER_AUTOSAVE_INTERVAL and PERSONAL_MANAGER_AUTOSAVE_CHANGES
+        by default, an interval of 0 turns the autosave off."""
+        if interval is None:
+            interval = float(os.environ.get("PERSONAL_MANAGER_AUTOSAVE_INTERVAL", AUTOSAVE_INTERVAL))
+        if changes is None:
+            changes = int(os.environ.get("PERSONAL_MANAGER_AUTOSAVE_CHANGES", AUTOSAVE_CHANGES))
+        if not self.journal or interval <= 0 or self._autosave:
+            return
+        self.autosave_changes = changes
+        self._autosave_stop = False
+        self._autosave = threading.Thread(target=self._autosave_loop, args=(interval,), name="autosave", daemon=True)
+        self._autosave.start()
+
+    def _autosave_loop(self, interval: float) -> None:
+        while True:
+            self._autosave_wake.wait(interval)
+            self._autosave_wake.clear()
+            if self._autosave_stop:
+                return
+            if self.journal.size():
+                self.compact()
+
+    def stop_autosave(self) -> None:
+        if self._autosave:
+            self._autosave_stop = True
+            self._autosave_wake.set()
+            self._autosave.join()
+            self._autosave = None
+
+    def similar_contacts(self, query: str, limit: int = FUZZY_LIMIT) -> List[str]:
+        """Names of the contacts whose names or emails are the most similar to the query, the closest first"""
+        return self.fuzzy_index.similar(query, limit) if query.strip() else []
+
+    def _find_name(self, message: str) -> Optional[str]:
+        """Returns the entered contact name or, if there is no such contact, the one the user picks
+        among the contacts with the most similar names and emails"""
+        name_contact = ''.join(self.__get_params({message: ""})).strip().capitalize()
+        if name_contact in self.data:
+            return name_contact
+        similar = self.similar_contacts(name_contact)
+        if not similar:
+            print("There is no contact with provided name.")
+            return None
+        option, index = pick(similar + ["NONE OF THEM"], \
+            f"There is no contact {name_contact}. Select the contact you meant.", indicator="=>")
+        return option if index < len(similar) else None
 
     def _find_contact(self, message: str) -> Optional[Record]:
-        name_contact = ''.join(self.__get_params({message: ""})).capitalize()
-        record: Optional[Record] = self.data.get(name_contact)
-        if record:
-            return record
-        print("There is no contact with provided name.")
+        name_contact = self._find_name(message)
+        return self.data.get(name_contact) if name_contact else None
 
     def print_record_notes(self, record: Record) -> None:
         if record:
@@ -520,10 +2850,11 @@ class AddressBook(UserDict):
                     print(note)
 
     def add_note(self) -> None:
-        record = self._find_contact("contact to add a note")
+        record = self._editable(self._find_contact("contact to add a note"))
         if record:
             note, tags = self.__get_params({"note": "", "tags": ""})
             record.note.append(Note(note, tags))
+            self._record_updated(record)
             print("Note was added.")
 
     def print_notes(self) -> None:
@@ -534,39 +2865,67 @@ class AddressBook(UserDict):
     def edit_note(self, rec: Optional[Record] = None) -> None:
         record = rec
         if not record:
-            record = self._find_contact("contact to edit")
+            record = self._editable(self._find_contact("contact to edit"))
         if record:
             notes = [note.value for note in record.note]
             index = pick(notes, "Select the note you want to edit.", indicator="=>")[1]
             note, tags = self.__get_params({"note": "", "tags": ""})
             record.note[index] = Note(note, tags)
+            self._record_updated(record)
             print("Note was edited.")
 
     def del_note(self) -> None:
-        record = self._find_contact("contact")
+        record = self._editable(self._find_contact("contact"))
         if record:
             notes = [note.value for note in record.note]
             index = pick(notes, "Select the note you want to delete.", indicator="=>")[1]
             del record.note[index]
+            self._record_updated(record)
             print("Note was deleted.")
 
+    def notes_by_tags(self, tags: List[str], match_all: bool = False, page: int = 0, \
+        page_size: Optional[int] = None) -> List[Tuple[str, Note]]:
+        """Returns one page of (name, note) pairs for notes with any (or all, if match_all is set) of the tags,
+        the newest note first. Without page_size all found notes are returned."""
+        found = self.tag_index.notes(tags, match_all)
+        if page_size:
+            return list(islice(found, page * page_size, (page + 1) * page_size))
+        return list(found)
+
     def find_sort_note(self) -> None:
-        found_tag = False
-        tag_name = "".join(self.__get_params({"tag name": ""}))
-        for name, rec in self.data.items():
-            filtered_notes = []
-            for note in rec.note:
-                if tag_name in [tag.value for tag in note.tag]:
-                    filtered_notes.append(note)
-                    found_tag = True
-            for sorted_note in sorted(filtered_notes, key=lambda note: note._created_at, reverse=True):
-                print(sorted_note)
-        if not found_tag:
+        """Tags separated by ";" find the notes containing all of them"""
+        tags = "".join(self.__get_params({"tag name": ""})).split(";")
+        found_notes = self.notes_by_tags(tags, match_all=True)
+        for _, note in found_notes:
+            print(note)
+        if not found_notes:
             print("Sorry, we could not find notes for the tag you specified.")
 
-    def show_contacts(self, items_count: str = 1):
-        for contacts in self.iterator(items_count):
-            print(*contacts)
+    def search_notes(self, query: str, limit: int = NOTE_SEARCH_LIMIT, tags: Iterable[str] = (),
+                     since: Optional[datetime] = None, until: Optional[datetime] = None) -> List[Tuple[str, Note]]:
+        """Returns (name, note) pairs of the limit notes that match the words, prefixes and phrases of the query best,
+        optionally only the notes with all of the tags created since and before until"""
+        return self.note_index.search_notes(query, limit, [tag for tag in tags if tag], since, until)
+
+    def find_text_note(self) -> None:
+        """Words, prefixes like "proj*" and "quoted phrases" of the query rank the notes, tags and dates narrow them"""
+        query, tags, since, until = self.__get_params({"search query": "", "tags": "", \
+            "first date of the notes (DD.MM.YYYY)": "", "last date of the notes (DD.MM.YYYY)": ""})
+        try:
+            since = datetime.strptime(since.strip(), "%d.%m.%Y") if since.strip() else None
+            until = datetime.strptime(until.strip(), "%d.%m.%Y") + timedelta(days=1) if until.strip() else None
+        except ValueError:
+            print("The dates must be in the DD.MM.YYYY format!")
+            return
+        found_notes = self.search_notes(query, tags=[tag.strip() for tag in tags], since=since, until=until)
+        for name, note in found_notes:
+            print(f"{name}: {note}")
+        if not found_notes:
+            print("Sorry, we could not find notes for the query you specified.")
+
+    def show_contacts(self, items_count: str = 1, sort_by: Optional[str] = None):
+        with listing_output() as output:
+            write_lines((" ".join(contacts) for contacts in self.iterator(items_count, sort_by)), output)
 
     def show_commands(self) -> None:
         """Displaying commands with the ability to execute them"""
@@ -577,26 +2936,162 @@ class AddressBook(UserDict):
         functions_list[index]()
 
 
+class CommandMetrics:
+    """Opt-in metrics of the commands: calls, wall time and the net blocks, the change of sys.getallocatedblocks()
+    over the calls, i.e. the memory blocks they left allocated (negative when they freed more than they allocated),
+    not the number of allocations they made.
+    With trace_memory the peak memory allocated while running is traced with tracemalloc too; tracing slows
+    every allocation down, so the times of such a session are labelled as traced and are not comparable to plain ones.
+    The commands in profile_commands also run under cProfile and their stats are dumped into "<command>.prof" files."""
+
+    def __init__(self, summary_file: Optional[str] = None, profile_commands: Iterable[str] = (),
+                 trace_memory: bool = False) -> None:
+        self.stats: Dict[str, Dict[str, float]] = {}
+        self.summary_file = summary_file
+        self.profile_commands = set(profile_commands)
+        self.trace_memory = trace_memory or tracemalloc.is_tracing()
+        self._started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+
+    def measure(self, name: str, func, *args):
+        """Calls func with the args and adds the costs of the call to the stats of the name"""
+        import cProfile
+        profiler = cProfile.Profile() if name in self.profile_commands else None
+        blocks = sys.getallocatedblocks()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            memory = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            return profiler.runcall(func, *args) if profiler else func(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            stats = self.stats.setdefault(name, {"calls": 0, "time": 0.0, "max_time": 0.0, "net_blocks": 0})
+            stats["calls"] += 1
+            stats["time"] += elapsed
+            stats["max_time"] = max(stats["max_time"], elapsed)
+            if self.trace_memory:
+                stats["traced"] = True
+                stats["peak_memory"] = max(stats.get("peak_memory", 0), tracemalloc.get_traced_memory()[1] - memory)
+            stats["net_blocks"] += sys.getallocatedblocks() - blocks
+            if profiler:
+                profiler.dump_stats(f"{name}.prof")
+                print(f"Profile of the command \"{name}\" is saved to \"{name}.prof\"")
+
+    def summary(self) -> str:
+        peak = f"{'peak, KiB':>12}" if self.trace_memory else ""
+        lines = [f"{'command':<20}{'calls':>8}{'total, ms':>12}{'mean, ms':>12}{'max, ms':>12}{peak}{'net blocks':>12}"]
+        for name, stats in sorted(self.stats.items(), key=lambda item: -item[1]["time"]):
+            peak = f"{stats['peak_memory'] / 1024:>12.1f}" if self.trace_memory else ""
+            lines.append(f"{name:<20}{stats['calls']:>8}{stats['time'] * 1000:>12.3f}"
+                         f"{stats['time'] * 1000 / stats['calls']:>12.3f}{stats['max_time'] * 1000:>12.3f}"
+                         f"{peak}{stats['net_blocks']:>12}")
+        if self.trace_memory:
+            lines.append("The times are traced: tracemalloc was on and slowed the commands down.")
+        return "\n".join(lines)
+
+    def report(self) -> None:
+        """Prints the summary of the session and saves the stats as JSON into the summary file if it is set"""
+        print(self.summary())
+        if self.summary_file:
+            with open(self.summary_file, "w", encoding="utf-8") as fn:
+                json.dump(self.stats, fn, indent=2)
+        if self._started_tracing:
+            tracemalloc.stop()
+
+
+def command_metrics(argv: List[str]) -> Optional[CommandMetrics]:
+    """Enables the command metrics with --profile[=summary.json] or PERSONAL_MANAGER_PROFILE=1|summary.json.
+    --profile-command=NAME or PERSONAL_MANAGER_PROFILE_COMMANDS=NAME,NAME also dump cProfile stats of the commands.
+    --profile-memory or PERSONAL_MANAGER_PROFILE_MEMORY=1 also traces the peak memory of the commands."""
+    profile = os.environ.get("PERSONAL_MANAGER_PROFILE")
+    commands = [name for name in os.environ.get("PERSONAL_MANAGER_PROFILE_COMMANDS", "").split(",") if name]
+    trace_memory = os.environ.get("PERSONAL_MANAGER_PROFILE_MEMORY", "") not in ("", "0")
+    for arg in argv:
+        option, _, value = arg.partition("=")
+        if option == "--profile":
+            profile = value or "1"
+        elif option == "--profile-command" and value:
+            commands.append(value)
+        elif option == "--profile-memory":
+            trace_memory = True
+    if not profile and not commands and not trace_memory:
+        return None
+    return CommandMetrics(None if profile in (None, "1") else profile, commands, trace_memory)
+
+
+class BackgroundLoad:
+    """Runs the loading of the address book in a thread while the first command is typed.
+    Until wait() it stands in for sys.stdout and holds back what the loading prints, so it does not break into the prompt.
+    An exception of the loading is raised again by wait(), so no command works on a book that is not loaded."""
+
+    def __init__(self, load, *args) -> None:
+        self.stdout = sys.stdout
+        self.output = StringIO()
+        self.error: Optional[BaseException] = None
+        self.thread = threading.Thread(target=self._load, args=(load, *args), name="data-loading", daemon=True)
+        sys.stdout = self
+        self.thread.start()
+
+    def _load(self, load, *args) -> None:
+        try:
+            load(*args)
+        except BaseException as error:
+            self.error = error
+
+    def write(self, text: str) -> int:
+        return (self.output if threading.current_thread() is self.thread else self.stdout).write(text)
+
+    def __getattr__(self, name: str):
+        return getattr(self.stdout, name)
+
+    def wait(self) -> None:
+        """Blocks until the address book is loaded, prints the messages of the loading and raises its exception"""
+        self.thread.join()
+        if sys.stdout is self:
+            sys.stdout = self.stdout
+            self.stdout.write(self.output.getvalue())
+        if self.error:
+            raise self.error
+
+
 class CommandHandler:
 
+    def __init__(self, metrics: Optional[CommandMetrics] = None, loading: Optional[BackgroundLoad] = None) -> None:
+        self.metrics = metrics
+        self.loading = loading
+
+    def _run(self, command: str) -> None:
+        if self.loading and command not in OFFLINE_COMMANDS:
+            self.loading.wait()
+        if self.metrics:
+            self.metrics.measure(command, commands_func[command])
+        else:
+            commands_func[command]()
+
     def __call__(self, command: str) -> bool:
         if command in exit_commands:
             return False
         elif command in action_commands:
-            commands_func[command]()
+            self._run(command)
             return True
-        command = get_close_matches(command, action_commands + exit_commands)
+        from difflib import get_close_matches
+        if self.metrics:
+            command = self.metrics.measure("get_close_matches", get_close_matches, command, action_commands + exit_commands)
+        else:
+            command = get_close_matches(command, action_commands + exit_commands)
         in_exit = not set(command).isdisjoint(exit_commands)
         if in_exit:
             return False
         in_action = not set(command).isdisjoint(action_commands)
         if in_action:
             if len(command) == 1:
-                commands_func[command[0]]()
+                self._run(command[0])
             elif len(command) > 1:
                 command = pick(command, TITLE, indicator="=>")[0]
                 print(f"You have selected the {command} command. Let's continue.")
-                commands_func[command]()
+                self._run(command)
         else:
             print("Sorry, I could not recognize this command!")
         return True
@@ -605,32 +3100,480 @@ class CommandHandler:
 book = AddressBook()
 TITLE = "We have chosen several options from the command you provided.\nPlease choose the one that you need."
 action_commands = ["help", "add_contact", "edit_record", "holidays_period", "print_notes", "add_note", \
-    "edit_note", "del_note", "find_note", "add_tag", "sort_files", "find_contact", "del_contact", "show_contacts"]
+    "edit_note", "del_note", "find_note", "add_tag", "sort_files", "find_contact", "del_contact", "show_contacts", \
+    "import_contacts", "export_contacts", "search_notes"]
 description_commands = ["Display all commands", "Add user to the address book", \
     "Edit information for the specified user", "Amount of days where we are looking for birthdays", \
     "Show notes for the specified user", "Add notes to the specified user", "Edit the notes for the specified user", \
     "Delete the notes for the specified user", "Find notes for specified user", \
     "Add tag for the specified user", "Sorts files in the specified directory", \
     "Search for the specified user by name", "Delete the specified user", \
-    "Show all contacts in address book", "Exit from program"]
+    "Show all contacts in address book", "Import contacts from a CSV or vCard file", \
+    "Export contacts to a CSV or vCard file", "Search the text of notes", "Exit from program"]
 exit_commands = ["good_bye", "close", "exit"]
 functions_list = [book.show_commands, book.add_record, book.edit_record, book.holidays_period, \
     book.print_notes, book.add_note, book.edit_note, book.del_note, book.find_sort_note, book.add_tags, \
-    book.sort_files, book.find_contact, book.del_contact, book.show_contacts, exit]
+    book.sort_files, book.find_contact, book.del_contact, book.show_contacts, book.import_contacts, \
+    book.export_contacts, book.find_text_note, exit]
 commands_func = {cmd: func for cmd, func in zip(action_commands, functions_list)}
 commands_desc = [f"{cmd:<15} -  {desc}" for cmd, desc in zip(action_commands + [', '.join(exit_commands)], description_commands)]
 
+def batch_list(value) -> List[str]:
+    """List parameters are JSON arrays or strings separated by ";" like in the prompts"""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.split(";")
+    return [str(item).strip() for item in value if str(item).strip()]
+
+
+def batch_contact(book: AddressBook, params: Dict) -> Record:
+    name = str(params.get("name", "")).strip()
+    record = book.data.get(name) or book.data.get(name.capitalize())
+    if not record:
+        raise ValueError(f"Contact {name} not found!")
+    return record
+
+
+def batch_note_index(record: Record, params: Dict) -> int:
+    index = int(params.get("index", 0))
+    if not 0 <= index < len(record.note):
+        raise ValueError(f"The contact {record.name.value} has no note with index {index}")
+    return index
+
+
+def batch_fields(params: Dict) -> Dict[str, object]:
+    """Checks the contact fields given in the params and returns them as the arguments of Record"""
+    fields = {}
+    if "phones" in params:
+        fields["phone"] = batch_list(params["phones"])
+        for phone in fields["phone"]:
+            try:
+                Phone(phone)
+            except InvalidPhoneNumber:
+                raise ValueError(f"The phone number \"{phone}\" is invalid")
+    if "emails" in params:
+        fields["email"] = batch_list(params["emails"])
+        for email in fields["email"]:
+            try:
+                Email(email)
+            except InvalidEmailAddress:
+                raise ValueError(f"The email \"{email}\" is invalid")
+    if params.get("birthday"):
+        fields["birthday"] = str(params["birthday"]).strip()
+        try:
+            Birthday.parse(fields["birthday"])
+        except ValueError:
+            raise ValueError(f"The birthday \"{fields['birthday']}\" is not in the DD.MM.YYYY format")
+    if "addresses" in params:
+        fields["address"] = batch_list(params["addresses"])
+    if "notes" in params:
+        fields["note"] = batch_list(params["notes"])
+    return fields
+
+
+def batch_add_contact(book: AddressBook, params: Dict) -> Dict[str, object]:
+    name = str(params.get("name", "")).strip()
+    if not name:
+        raise ValueError("The name is required")
+    if name.capitalize() in book.data:
+        raise ValueError(f"The username {name.capitalize()} is already registered in the address book")
+    fields = {"phone": [], "address": [], "email": [], "note": [], **batch_fields(params)}
+    record = Record(name, **fields)
+    book[record.name.value] = record
+    return record.to_dict()
+
+
+def batch_edit_record(book: AddressBook, params: Dict) -> Dict[str, object]:
+    """Replaces the given fields of the contact, new_name renames it"""
+    record = book._editable(batch_contact(book, params))
+    old_name = record.name.value
+    new_name = str(params.get("new_name", "")).strip().capitalize()
+    if new_name and new_name != old_name and new_name in book.data:
+        raise ValueError(f"The username {new_name} is already registered in the address book")
+    fields = batch_fields(params)
+    if "phone" in fields:
+        record.phone = [Phone(phone) for phone in fields["phone"]]
+    if "email" in fields:
+        record.email = [Email(email) for email in fields["email"]]
+    if "address" in fields:
+        record.address = [Address(address) for address in fields["address"]]
+    if "note" in fields:
+        record.note = [Note(note) for note in fields["note"]]
+    if "birthday" in fields:
+        record.birthday = Birthday(fields["birthday"])
+    if new_name:
+        record.name.value = new_name
+    book._record_updated(record, old_name)
+    return record.to_dict()
+
+
+def batch_del_contact(book: AddressBook, params: Dict) -> str:
+    name = batch_contact(book, params).name.value
+    del book[name]
+    return name
+
+
+def batch_add_note(book: AddressBook, params: Dict) -> Dict[str, object]:
+    record = book._editable(batch_contact(book, params))
+    record.note.append(Note(str(params.get("note", "")), batch_list(params.get("tags"))))
+    book._record_updated(record)
+    return record.to_dict()
+
+
+def batch_edit_note(book: AddressBook, params: Dict) -> Dict[str, object]:
+    record = book._editable(batch_contact(book, params))
+    record.note[batch_note_index(record, params)] = Note(str(params.get("note", "")), batch_list(params.get("tags")))
+    book._record_updated(record)
+    return record.to_dict()
+
+
+def batch_del_note(book: AddressBook, params: Dict) -> Dict[str, object]:
+    record = book._editable(batch_contact(book, params))
+    del record.note[batch_note_index(record, params)]
+    book._record_updated(record)
+    return record.to_dict()
+
+
+def batch_add_tag(book: AddressBook, params: Dict) -> Dict[str, object]:
+    record = book._editable(batch_contact(book, params))
+    record.note[batch_note_index(record, params)].tag.extend(Tag(tag) for tag in batch_list(params.get("tags")))
+    book._record_updated(record)
+    return record.to_dict()
+
+
+def batch_print_notes(book: AddressBook, params: Dict) -> List[Dict[str, object]]:
+    return batch_contact(book, params).to_dict()["notes"]
+
+
+def batch_find_contact(book: AddressBook, params: Dict) -> List[Dict[str, object]]:
+    return [record.to_dict() for record in book.search_contacts(str(params.get("query", "")))]
+
+
+def batch_holidays_period(book: AddressBook, params: Dict) -> List[Dict[str, object]]:
+    return [record.to_dict() for record in book.upcoming_birthdays(min(int(params.get("period", 7)), 365))]
+
+
+def batch_flag(params: Dict, name: str, default: bool = False) -> bool:
+    """Flags are JSON booleans or strings like true/false, 1/0, yes/no"""
+    return str(params.get(name, default)).lower() not in ("false", "0", "no", "")
+
+
+def batch_find_note(book: AddressBook, params: Dict) -> List[Dict[str, object]]:
+    """Notes with all of the tags (any of them if match_all is false), page_size of them from the page"""
+    match_all = batch_flag(params, "match_all", True)
+    page_size = int(params["page_size"]) if params.get("page_size") else None
+    found = book.notes_by_tags(batch_list(params.get("tags")), match_all, int(params.get("page", 0)), page_size)
+    return [{"name": name, "note": note.value, "tags": [tag.value for tag in note.tag],
+             "created_at": note._created_at.isoformat()} for name, note in found]
+
+
+def batch_search_notes(book: AddressBook, params: Dict) -> List[Dict[str, object]]:
+    """The best notes for the query, limit of them, with all of the tags and created between since and until (DD.MM.YYYY)"""
+    try:
+        since = datetime.strptime(str(params["since"]).strip(), "%d.%m.%Y") if params.get("since") else None
+        until = datetime.strptime(str(params["until"]).strip(), "%d.%m.%Y") + timedelta(days=1) \
+            if params.get("until") else None
+    except ValueError:
+        raise ValueError("The dates must be in the DD.MM.YYYY format")
+    found = book.search_notes(str(params.get("query", "")), int(params.get("limit", NOTE_SEARCH_LIMIT)),
+                              batch_list(params.get("tags")), since, until)
+    return [{"name": name, "note": note.value, "tags": [tag.value for tag in note.tag],
+             "created_at": note._created_at.isoformat()} for name, note in found]
+
+
+def batch_show_contacts(book: AddressBook, params: Dict) -> List[Dict[str, object]]:
+    page_size = int(params.get("page_size", 10))
+    pages = book.pages(page_size, params.get("sort_by") or None)
+    page = next(islice(pages, int(params.get("page", 0)), None), ([], None))[0]
+    return [record.to_dict() for record in page]
+
+
+def batch_sort_files(book: AddressBook, params: Dict):
+    """Sorts the folder of the path with workers threads, or lists the planned moves with dry_run,
+    sorts only the changed folders with incremental, moves the files of the last sorting back with undo
+    or polls the folder rounds times every interval seconds with watch. manifest sets the manifest file."""
+    path = str(params.get("path", ""))
+    if not os.path.isdir(path):
+        raise ValueError("Wrong path!")
+    workers = int(params["workers"]) if params.get("workers") else None
+    manifest = str(params["manifest"]) if params.get("manifest") else None
+    if batch_flag(params, "undo"):
+        return {"undone": undo_sort(manifest or os.path.join(path, SORT_MANIFEST))}
+    if batch_flag(params, "watch"):
+        if not params.get("rounds"):
+            raise ValueError("The watch mode needs the number of rounds in the batch mode")
+        interval = float(params["interval"]) if params.get("interval") else None
+        return {"moved": watch_files(path, interval, workers, int(params["rounds"]))}
+    if batch_flag(params, "dry_run"):
+        return [{"source": source, "destination": destination, "link": link}
+                for source, destination, link in planned_moves(path)]
+    return sort_files_entry_point(path, workers, manifest=manifest, incremental=batch_flag(params, "incremental")).to_dict()
+
+
+def batch_import_contacts(book: AddressBook, params: Dict) -> Dict[str, object]:
+    return book.import_file(str(params.get("path", ""))).to_dict()
+
+
+def batch_export_contacts(book: AddressBook, params: Dict) -> int:
+    return book.export_file(str(params.get("path", "")))
+
+
+batch_commands = {"add_contact": batch_add_contact, "edit_record": batch_edit_record,
+    "del_contact": batch_del_contact, "add_note": batch_add_note, "edit_note": batch_edit_note,
+    "del_note": batch_del_note, "add_tag": batch_add_tag, "print_notes": batch_print_notes,
+    "find_contact": batch_find_contact, "holidays_period": batch_holidays_period, "find_note": batch_find_note,
+    "show_contacts": batch_show_contacts, "sort_files": batch_sort_files,
+    "import_contacts": batch_import_contacts, "export_contacts": batch_export_contacts,
+    "search_notes": batch_search_notes}
+batch_writes = {"add_contact", "edit_record", "del_contact", "add_note", "edit_note", "del_note", "add_tag",
+    "import_contacts"}
+batch_file_commands = {"sort_files", "import_contacts", "export_contacts"}
+
+
+def parse_batch_line(line: str) -> Tuple[str, Dict]:
+    """A line is a JSON object with the "command" key and the parameters
+    or the command followed by key=value parameters quoted like in the shell"""
+    if line.startswith("{"):
+        params = json.loads(line)
+        if not isinstance(params, dict):
+            raise ValueError("A JSON command must be an object")
+        return str(params.pop("command", "")), params
+    command, *args = shlex.split(line)
+    params = {}
+    for arg in args:
+        key, separator, value = arg.partition("=")
+        if not separator:
+            raise ValueError(f"The parameter \"{arg}\" is not in the key=value format")
+        params[key] = value
+    return command, params
+
+
+def run_batch_command(book: AddressBook, command: str, params: Dict, metrics: Optional[CommandMetrics] = None):
+    if command not in batch_commands:
+        raise ValueError(f"Unknown command \"{command}\"")
+    if metrics:
+        return metrics.measure(command, batch_commands[command], book, params)
+    return batch_commands[command](book, params)
+
+
+def batch_result(book: AddressBook, line: str, number: int, metrics: Optional[CommandMetrics] = None,
+                 lock: Optional["ReadWriteLock"] = None) -> Dict[str, object]:
+    """Runs the command of the line and returns its result or error. With the lock the commands
+    of batch_writes run alone and the others together, and the commands of batch_file_commands are refused:
+    the daemon serves the book, not the files its clients name."""
+    result = {"line": number}
+    try:
+        command, params = parse_batch_line(line)
+        result["command"] = command
+        if lock and command in batch_file_commands:
+            raise ValueError(f"The command \"{command}\" works with files and is not served by the daemon")
+        if lock:
+            with lock.writing() if command in batch_writes or lock.exclusive else lock.reading():
+                value = run_batch_command(book, command, params, metrics)
+                if command in batch_writes:
+                    book.flush_journal()
+        else:
+            value = run_batch_command(book, command, params, metrics)
+        result.update(ok=True, result=value)
+    except (ValueError, TypeError, OSError) as error:
+        result.update(ok=False, error=str(error))
+    return result
+
+
+def run_batch(book: AddressBook, lines: Iterable[str], output, metrics: Optional[CommandMetrics] = None) -> int:
+    """Runs the commands of the lines against the book without any prompts and writes one JSON line per command
+    with its result or error to the output. Messages meant for the user go to stderr.
+    Changes of an SQLite book are committed once at the end. Returns the number of failed commands."""
+    failed = 0
+    buffer = StringIO()
+    deferred = isinstance(book.data, SQLiteRecords)
+    if deferred:
+        book.data.deferred = True
+    try:
+        with redirect_stdout(sys.stderr):
+            for number, line in enumerate(lines, 1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                result = batch_result(book, line, number, metrics)
+                failed += not result["ok"]
+                buffer.write(json.dumps(result, ensure_ascii=False) + "\n")
+                if buffer.tell() >= OUTPUT_BUFFER_SIZE:
+                    output.write(buffer.getvalue())
+                    buffer = StringIO()
+    finally:
+        output.write(buffer.getvalue())
+        output.flush()
+        if deferred:
+            book.data.commit()
+            book.data.deferred = False
+    return failed
+
+
+def main_batch(batch: str, data_file: Path, metrics: Optional[CommandMetrics] = None) -> int:
+    """Runs the commands of the batch file ("-" for stdin) and saves the book once if anything was changed.
+    Returns the exit code, 1 if any command failed."""
+    try:
+        lines = sys.stdin if batch == "-" else open(batch, encoding="utf-8")
+    except OSError:
+        print(f"An error occurred while opening the file \"{batch}\"", file=sys.stderr)
+        return 1
+    try:
+        failed = run_batch(book, lines, sys.stdout, metrics)
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+    with redirect_stdout(sys.stderr):
+        if book.journal and book._changes:
+            book.save_data(data_file)
+        if metrics:
+            metrics.report()
+    return 1 if failed else 0
+
+
+class ReadWriteLock:
+    """Lets in many readers or one writer, a waiting writer keeps new readers out.
+    With exclusive set the readers are let in one by one as well."""
+
+    def __init__(self, exclusive: bool = False) -> None:
+        self.exclusive = exclusive
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writers = 0
+        self._writing = False
+
+    @contextmanager
+    def reading(self):
+        with self._condition:
+            self._condition.wait_for(lambda: not self._writing and not self._writers)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def writing(self):
+        with self._condition:
+            self._writers += 1
+            self._condition.wait_for(lambda: not self._writing and not self._readers)
+            self._writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+def stop_serving(signum, frame) -> None:
+    raise KeyboardInterrupt
+
+
+def main_serve(path: str, data_file: Path, metrics: Optional[CommandMetrics] = None) -> int:
+    """Keeps the loaded book in memory and serves the batch commands over the Unix socket until it is stopped
+    with Ctrl+C or SIGTERM. Every connection gets a thread, reads run together and writes one at a time,
+    each write is journaled before it is answered. An SQLite book or a book with metrics serves one command at a time.
+    Only the commands of the book are served, the ones of batch_file_commands run in the batch mode."""
+    import socket
+    import socketserver
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+            print(f"The daemon is already running on \"{path}\"", file=sys.stderr)
+            return 1
+        except OSError:
+            os.remove(path)
+        finally:
+            probe.close()
+    lock = ReadWriteLock(exclusive=isinstance(book.data, SQLiteRecords) or metrics is not None)
+
+    class BookRequestHandler(socketserver.StreamRequestHandler):
+
+        def handle(self) -> None:
+            for number, line in enumerate(self.rfile, 1):
+                line = line.decode("utf-8", errors="replace").strip()
+                if not line or line.startswith("#"):
+                    continue
+                result = batch_result(book, line, number, metrics, lock)
+                self.wfile.write(json.dumps(result, ensure_ascii=False).encode("utf-8") + b"\n")
+
+    server = socketserver.ThreadingUnixStreamServer(path, BookRequestHandler)
+    server.daemon_threads = True
+    signal.signal(signal.SIGTERM, stop_serving)
+    print(f"Serving the address book \"{data_file}\" on \"{path}\"", file=sys.stderr)
+    try:
+        with redirect_stdout(sys.stderr):
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+        with redirect_stdout(sys.stderr), lock.writing():
+            book.stop_autosave()
+            book.flush_journal()
+            book.wait_compaction()
+            if metrics:
+                metrics.report()
+    return 0
+
+
+def load_book(data_file: Path, migrate: Optional[Path] = None, autosave: bool = False) -> None:
+    """Loads the address book from the data file and, for a new SQLite database, imports the pickle file into it"""
+    book.load_data(data_file)
+    if migrate:
+        print(f"Imported {book.import_pickle(migrate)} contacts from \"{migrate}\"")
+    if autosave:
+        book.start_autosave()
+
+
 def main():
     current_script_path = Path(__file__).absolute()
     file_bin_name = f"{current_script_path.stem}.bin"
     data_file = current_script_path.parent.joinpath(file_bin_name)
-    """get data file from current directory"""
-    book.load_data(data_file)
-    command = CommandHandler()
+    """get data file from current directory, PERSONAL_MANAGER_DATA overrides it"""
+    data_file = Path(os.environ.get("PERSONAL_MANAGER_DATA", data_file))
+    batch = serve = None
+    for arg in sys.argv[1:]:
+        option, _, value = arg.partition("=")
+        if option == "--batch":
+            batch = value or "-"
+        elif option == "--serve":
+            serve = daemon_socket(value)
+    migrate = None
+    if os.environ.get("PERSONAL_MANAGER_STORAGE") == "sqlite":
+        pickle_file, data_file = data_file, data_file.with_suffix(SQLITE_SUFFIXES[0])
+        if not data_file.exists() and (pickle_file.exists() or Journal(pickle_file).size()):
+            migrate = pickle_file
+    metrics = command_metrics(sys.argv[1:])
+    if batch:
+        with redirect_stdout(sys.stderr):
+            load_book(data_file, migrate)
+        sys.exit(main_batch(batch, data_file, metrics))
+    if serve:
+        with redirect_stdout(sys.stderr):
+            load_book(data_file, migrate, autosave=True)
+        sys.exit(main_serve(serve, data_file, metrics))
+    """the book is loaded while the first command is typed, the commands that need it wait for the loading"""
+    loading = BackgroundLoad(load_book, data_file, migrate, True)
+    command = CommandHandler(metrics, loading)
     input_msg = input("Hello, please enter the command: ").lower().strip()
     while command(input_msg):
+        book.flush_journal()
         input_msg = input("Please enter the command: ").lower().strip()
-    book.save_data(data_file)
+    loading.wait()
+    book.stop_autosave()
+    book.flush_journal()
+    book.wait_compaction()
+    if metrics:
+        metrics.report()
     print("Have a nice day... Good bye!")
 
 
@@ -8,6 +8,8 @@ setup(name='personal_manager',
       author_email='leaderr99@gmail.com, angelikak199712@gmail.com, korshunov.olexiy@gmail.com',
       license='MIT',
       install_requires=['pick==1.2.0', 'wheel'],
-      packages=find_namespace_packages(),
-      entry_points={'console_scripts': ['personal-manager=personal_manager.personal_manager:main']}
+      packages=find_namespace_packages(include=['personal_manager*']),
+      entry_points={'console_scripts': ['personal-manager=personal_manager.personal_manager:main',
+                                          'personal-manager-benchmark=personal_manager.benchmark:main',
+                                          'personal-manager-client=personal_manager.client:main']}
       )
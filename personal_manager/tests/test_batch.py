@@ -0,0 +1,47 @@
+import io
+import json
+
+from personal_manager import personal_manager as pm
+
+
+def run(book, lines):
+    output = io.StringIO()
+    failed = pm.run_batch(book, lines, output)
+    return failed, [json.loads(line) for line in output.getvalue().splitlines()]
+
+
+def test_failed_commands_are_reported_and_the_batch_goes_on():
+    book = pm.AddressBook()
+    lines = ['{"command": "add_contact", "name": "Olena"',
+             '["add_contact"]',
+             'fly_away name=Olena',
+             'add_contact Olena',
+             'add_note name=Nobody note=hello',
+             'add_contact name=Ivan birthday=31.02.1990',
+             'add_contact name=Ivan phones=12',
+             'add_contact name="Olena',
+             '# a comment',
+             '',
+             'add_contact name=Olena phones=+380501234567',
+             'add_contact name=olena',
+             'print_notes name=Olena']
+    failed, results = run(book, lines)
+    assert failed == 9
+    assert [result["ok"] for result in results] == [False] * 8 + [True, False, True]
+    assert [result["line"] for result in results] == [1, 2, 3, 4, 5, 6, 7, 8, 11, 12, 13]
+    errors = [result["error"] for result in results if not result["ok"]]
+    assert errors[1] == 'Unknown command "[add_contact]"'
+    assert errors[2] == 'Unknown command "fly_away"'
+    assert errors[4] == "Contact Nobody not found!"
+    assert list(book.data) == ["Olena"]
+
+
+def test_results_of_the_commands_in_order():
+    book = pm.AddressBook()
+    lines = ['add_contact name=Olena', 'add_note name=Olena note="call back" tags="work;urgent"',
+             '{"command": "find_note", "tags": ["urgent"]}', 'del_note name=Olena index=3', 'del_contact name=Olena']
+    failed, results = run(book, lines)
+    assert failed == 1
+    assert results[2]["result"][0]["note"] == "call back" and results[2]["result"][0]["tags"] == ["work", "urgent"]
+    assert results[3]["error"] == "The contact Olena has no note with index 3"
+    assert results[4]["result"] == "Olena" and not book.data
@@ -0,0 +1,49 @@
+from datetime import date, timedelta
+
+import pytest
+
+from personal_manager import personal_manager as pm
+
+BIRTHDAYS = {"Feb28": "28.02.1990", "Leap": "29.02.1992", "Mar1": "01.03.1991", "Newyear": "01.01.1985",
+             "Midyear": "15.06.2000", "Eve": "31.12.1999", "Leap2": "29.02.1996"}
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def book(request, tmp_path):
+    book = pm.AddressBook()
+    if request.param == "sqlite":
+        book.use_sqlite(str(tmp_path / "book.db"))
+    for name, birthday in BIRTHDAYS.items():
+        book[name] = pm.Record(name, [], birthday, [], [], [])
+    return book
+
+
+def expected(today, days):
+    keys = {name: pm.birthday_key(pm.Record(name, [], birthday, [], [], [])) for name, birthday in BIRTHDAYS.items()}
+    left = {name: pm.days_until_birthday(key, today) for name, key in keys.items()}
+    return sorted((name for name in keys if left[name] <= days), key=lambda name: (left[name], keys[name], name))
+
+
+@pytest.mark.parametrize("year", [2023, 2024])
+def test_upcoming_agrees_with_the_days_left(book, year):
+    for offset in range(366 if year == 2024 else 365):
+        today = date(year, 1, 1) + timedelta(days=offset)
+        for days in (0, 1, 7, 30, 364):
+            assert book.birthday_index.upcoming(today, days) == expected(today, days), (today, days)
+
+
+def test_leap_birthday_is_today_on_the_first_of_march_of_a_common_year(book):
+    assert book.birthday_index.upcoming(date(2023, 3, 1), 0) == ["Leap", "Leap2", "Mar1"]
+    assert book.birthday_index.upcoming(date(2024, 3, 1), 0) == ["Mar1"]
+    assert book.birthday_index.upcoming(date(2024, 2, 29), 0) == ["Leap", "Leap2"]
+
+
+def test_contacts_sorted_by_birthday_start_with_today(book, monkeypatch):
+    class Today(date):
+        @classmethod
+        def today(cls):
+            return cls(2023, 3, 1)
+
+    monkeypatch.setattr(pm, "date", Today)
+    pages = book.pages(3, "birthday")
+    assert [record.name.value for record in next(pages)[0]] == ["Leap", "Leap2", "Mar1"]
@@ -0,0 +1,43 @@
+import socket
+import threading
+
+import pytest
+
+from personal_manager import client
+from personal_manager import personal_manager as pm
+
+
+@pytest.mark.parametrize("line", ['sort_files path=/tmp', 'import_contacts path=/etc/passwd',
+                                  'export_contacts path=/tmp/contacts.csv'])
+def test_daemon_refuses_commands_with_files(line):
+    result = pm.batch_result(pm.AddressBook(), line, 1, lock=pm.ReadWriteLock())
+    assert not result["ok"] and "not served by the daemon" in result["error"]
+
+
+def test_daemon_serves_book_commands():
+    book = pm.AddressBook()
+    lock = pm.ReadWriteLock()
+    assert pm.batch_result(book, "add_contact name=olena", 1, lock=lock)["ok"]
+    assert [record["name"] for record in pm.batch_result(book, "find_contact query=olena", 2, lock=lock)["result"]] \
+        == ["Olena"]
+
+
+def test_client_reports_a_dropped_connection(tmp_path, capsys):
+    path = str(tmp_path / "daemon.sock")
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(1)
+
+    def drop():
+        connection, _ = server.accept()
+        connection.recv(1024)
+        connection.close()
+
+    thread = threading.Thread(target=drop)
+    thread.start()
+    try:
+        assert client.main([f"--socket={path}", "find_contact", "query=olena"]) == 2
+    finally:
+        thread.join()
+        server.close()
+    assert "The connection to the daemon" in capsys.readouterr().err
@@ -0,0 +1,62 @@
+import pytest
+
+from personal_manager import personal_manager as pm
+
+CONTACTS = {"Olena": ["olena@example.com"], "Olenka": [], "Oleh": ["oleh@work.example.com", "o.h@example.com"],
+            "Ivan": ["ivan.petrenko@example.com"], "Iryna": [], "Petro": ["petro@example.com"]}
+QUERIES = ["olena", "olna", "oleh@work", "ivan petrenko", "petrenko", "iryna", "xyz", "o", ""]
+
+
+def fill(book):
+    for name, emails in CONTACTS.items():
+        book[name] = pm.Record(name, [], None, [], emails, [])
+    return book
+
+
+@pytest.fixture
+def books(tmp_path):
+    sqlite = pm.AddressBook()
+    sqlite.use_sqlite(str(tmp_path / "book.db"))
+    return fill(pm.AddressBook()), fill(sqlite)
+
+
+def test_similar_finds_misspelt_names():
+    book = fill(pm.AddressBook())
+    assert book.similar_contacts("olna") == ["Olena"]
+    assert book.similar_contacts("olenka")[:2] == ["Olenka", "Olena"]
+    assert book.similar_contacts("ivan.petrenko")[0] == "Ivan"
+
+
+def test_sqlite_lookup_matches_the_memory_one(books):
+    memory, sqlite = books
+    for query in QUERIES:
+        assert sqlite.fuzzy_index.similar(query) == memory.fuzzy_index.similar(query), query
+
+
+def test_sqlite_trigrams_follow_edits_and_deletes(books):
+    for book in books:
+        record = book.data["Ivan"].copy()
+        record.email = []
+        book["Ivan"] = record
+        del book["Olena"]
+    memory, sqlite = books
+    assert "Ivan" not in sqlite.fuzzy_index.similar("petrenko")
+    for query in QUERIES:
+        assert sqlite.fuzzy_index.similar(query) == memory.fuzzy_index.similar(query), query
+    counts = sqlite.data.connection.execute("SELECT gram, count FROM trigram_counts WHERE count > 0").fetchall()
+    postings = sqlite.data.connection.execute("SELECT gram, COUNT(*) FROM trigrams GROUP BY gram").fetchall()
+    assert sorted(counts) == sorted(postings)
+
+
+def test_sqlite_trigrams_are_built_for_an_older_database(tmp_path):
+    filename = str(tmp_path / "book.db")
+    book = fill(pm.AddressBook())
+    book.use_sqlite(filename)
+    fill(book)
+    with book.data.connection as connection:
+        for table in ("trigram_keys", "trigrams", "trigram_counts"):
+            connection.execute(f"DELETE FROM {table}")
+    book.data.close()
+    reopened = pm.AddressBook()
+    reopened.use_sqlite(filename)
+    assert reopened.similar_contacts("olenka")[:2] == ["Olenka", "Olena"]
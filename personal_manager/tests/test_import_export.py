@@ -0,0 +1,59 @@
+import pytest
+
+from personal_manager import personal_manager as pm
+
+
+def contacts(book):
+    return sorted((record.to_dict() for record in book.data.values()), key=lambda contact: contact["name"])
+
+
+@pytest.fixture
+def book():
+    book = pm.AddressBook()
+    book["Olena"] = pm.Record("Olena", ["+380501234567"], "29.02.1992", ["Kyiv; Khreshchatyk, 1"],
+                              ["olena@example.com"], [])
+    book["Olena"].note = [pm.Note("call back, \"soon\"", ["work", "urgent"]), pm.Note("multi\nline")]
+    book["Ivan"] = pm.Record("Ivan", [], None, [], ["ivan@example.com", "ivan@work.example.com"], [])
+    return book
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".vcf"])
+def test_export_and_import_keep_the_contacts(tmp_path, book, suffix):
+    filename = str(tmp_path / f"contacts{suffix}")
+    assert book.export_file(filename) == 2
+    imported = pm.AddressBook()
+    report = imported.import_file(filename)
+    assert (report.imported, report.errors) == (2, 0)
+    expected = contacts(book)
+    for contact in expected:
+        for note in contact["notes"]:
+            note.pop("created_at", None)
+    found = contacts(imported)
+    for contact in found:
+        for note in contact["notes"]:
+            note.pop("created_at", None)
+    assert found == expected
+
+
+@pytest.mark.parametrize("existing", [0, 50])
+def test_imported_contacts_are_searchable(tmp_path, existing):
+    book = pm.AddressBook()
+    for i in range(existing):
+        book[f"Old{i}"] = pm.Record(f"Old{i}", [], None, [], [f"old{i}@example.com"], [])
+    filename = tmp_path / "contacts.csv"
+    filename.write_text("name,phones,birthday,addresses,emails,notes,tags\n"
+                        "new,,02.03.1990,,new@example.com,,\n"
+                        "old0,,,,,,\n"
+                        "bad,,31.02.1990,,,,\n", encoding="utf-8")
+    report = book.import_file(str(filename))
+    assert (report.imported, report.errors) == ((1, 2) if existing else (2, 1))
+    assert [record.name.value for record in book.search_contacts("new@example")] == ["New"]
+    assert book.birthday_index.between(302, 302) == ["New"]
+
+
+@pytest.mark.parametrize("birthday", ["31.02.1990", "1990-02-01", "01.02.90"])
+def test_batch_rejects_the_birthdays_the_prompt_rejects(birthday):
+    with pytest.raises(ValueError):
+        pm.Birthday.parse(birthday)
+    result = pm.batch_result(pm.AddressBook(), f"add_contact name=olena birthday={birthday}", 1)
+    assert not result["ok"] and "DD.MM.YYYY" in result["error"]
@@ -0,0 +1,60 @@
+import pickle
+
+from personal_manager import personal_manager as pm
+
+
+def contact(name):
+    return pm.Record(name, [], None, [], [f"{name}@example.com"], [])
+
+
+def test_compaction_merges_the_journal_into_the_snapshot(tmp_path):
+    filename = str(tmp_path / "book.bin")
+    book = pm.AddressBook()
+    book.load_data(filename)
+    for name in ("alice", "bob", "carol"):
+        book[name] = contact(name)
+    book.flush_journal()
+    book.compact()
+    del book["bob"]
+    book.flush_journal()
+    book.wait_compaction()
+    with open(filename, "rb") as fn:
+        assert sorted(pickle.load(fn)) == ["alice", "bob", "carol"]
+    restored = pm.AddressBook()
+    restored.load_data(filename)
+    assert sorted(restored.data) == ["alice", "carol"]
+
+
+def test_book_without_a_snapshot_loads_from_the_journal(tmp_path, capsys):
+    filename = str(tmp_path / "book.bin")
+    book = pm.AddressBook()
+    book.load_data(filename)
+    book["alice"] = contact("alice")
+    book.flush_journal()
+    capsys.readouterr()
+    restored = pm.AddressBook()
+    restored.load_data(filename)
+    output = capsys.readouterr().out
+    assert "An error occurred" not in output and "Restored 1 changes" in output
+    assert list(restored.data) == ["alice"]
+
+
+def test_replay_stops_at_an_entry_cut_off_by_a_crash(tmp_path):
+    filename = str(tmp_path / "book.bin")
+    book = pm.AddressBook()
+    book.load_data(filename)
+    for name in ("alice", "bob"):
+        book[name] = contact(name)
+        book.flush_journal()
+    size = book.journal.size()
+    with open(book.journal.filename, "r+b") as fn:
+        fn.truncate(size - 5)
+    restored = pm.AddressBook()
+    restored.load_data(filename)
+    assert list(restored.data) == ["alice"]
+    assert restored.journal.size() < size - 5
+    restored["carol"] = contact("carol")
+    restored.flush_journal()
+    again = pm.AddressBook()
+    again.load_data(filename)
+    assert sorted(again.data) == ["alice", "carol"]
@@ -0,0 +1,11 @@
+from personal_manager import personal_manager as pm
+
+
+def test_net_blocks_count_the_blocks_left_allocated():
+    metrics = pm.CommandMetrics()
+    kept = []
+    metrics.measure("keep", lambda: kept.extend(object() for _ in range(1000)))
+    metrics.measure("drop", lambda: kept.clear())
+    assert metrics.stats["keep"]["net_blocks"] >= 900
+    assert metrics.stats["drop"]["net_blocks"] <= -900
+    assert "net blocks" in metrics.summary().splitlines()[0]
@@ -0,0 +1,47 @@
+import io
+import json
+
+import pytest
+
+from personal_manager import personal_manager as pm
+
+NOTES = {"Alice": ["buy fresh milk and bread", "call the plumber about the sink"],
+         "Bob": ["milk milk milk for the cats", "plumbing estimate"],
+         "Carol": ["read a book about bread baking"]}
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def book(request, tmp_path):
+    book = pm.AddressBook()
+    if request.param == "sqlite":
+        book.use_sqlite(str(tmp_path / "book.db"))
+    for name, notes in NOTES.items():
+        book[name] = pm.Record(name, [], None, [], [], notes)
+    return book
+
+
+def found(book, query, limit=pm.NOTE_SEARCH_LIMIT):
+    return [(name, note.value) for name, note in book.search_notes(query, limit)]
+
+
+def test_search_ranks_the_most_frequent_word_first(book):
+    assert found(book, "milk") == [("Bob", "milk milk milk for the cats"), ("Alice", "buy fresh milk and bread")]
+
+
+def test_search_matches_prefixes_and_phrases(book):
+    assert {name for name, _ in found(book, "plumb*")} == {"Alice", "Bob"}
+    assert found(book, '"bread baking"') == [("Carol", "read a book about bread baking")]
+
+
+@pytest.mark.parametrize("limit", [0, -1])
+def test_search_without_room_for_results_finds_nothing(book, limit):
+    assert found(book, "milk bread", limit) == []
+
+
+def test_batch_search_with_a_bad_limit_does_not_stop_the_batch(book):
+    output = io.StringIO()
+    lines = ['{"command": "search_notes", "query": "milk", "limit": -1}',
+             '{"command": "search_notes", "query": "milk", "limit": 1}']
+    assert pm.run_batch(book, lines, output) == 0
+    results = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [len(result["result"]) for result in results] == [0, 1]
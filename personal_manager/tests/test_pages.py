@@ -0,0 +1,50 @@
+import io
+import json
+
+import pytest
+
+from personal_manager import personal_manager as pm
+
+NAMES = ["Olena", "Ivan", "Petro", "Anna", "Maria", "Bohdan", "Taras"]
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def book(request, tmp_path):
+    book = pm.AddressBook()
+    if request.param == "sqlite":
+        book.use_sqlite(str(tmp_path / "book.db"))
+    for name in NAMES:
+        book[name] = pm.Record(name, [], None, [], [], [])
+    return book
+
+
+def names(pages):
+    return [[record.name.value for record in records] for records, _ in pages]
+
+
+@pytest.mark.parametrize("sort_by, ordered", [(None, NAMES), ("name", sorted(NAMES))])
+def test_pages_cover_the_book_once(book, sort_by, ordered):
+    pages = names(book.pages(3, sort_by))
+    assert pages == [ordered[:3], ordered[3:6], ordered[6:]]
+
+
+@pytest.mark.parametrize("sort_by", [None, "name"])
+def test_saved_cursor_resumes_behind_its_page(book, sort_by):
+    _, cursor = next(book.pages(3, sort_by))
+    assert names(book.pages(3, sort_by, cursor)) == names(book.pages(3, sort_by))[1:]
+
+
+def test_name_cursor_survives_changes_of_the_book(book):
+    _, cursor = next(book.pages(2, "name"))
+    del book["Bohdan"]
+    book["Aaron"] = pm.Record("Aaron", [], None, [], [], [])
+    book["Lesya"] = pm.Record("Lesya", [], None, [], [], [])
+    assert sum(names(book.pages(2, "name", cursor)), []) == ["Ivan", "Lesya", "Maria", "Olena", "Petro", "Taras"]
+
+
+def test_batch_pages_beyond_the_end_are_empty(book):
+    output = io.StringIO()
+    lines = ['show_contacts page_size=3 page=2 sort_by=name', 'show_contacts page_size=3 page=5']
+    assert pm.run_batch(book, lines, output) == 0
+    results = [json.loads(line)["result"] for line in output.getvalue().splitlines()]
+    assert [[record["name"] for record in result] for result in results] == [["Taras"], []]
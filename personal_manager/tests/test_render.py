@@ -0,0 +1,44 @@
+import io
+import pickle
+
+import pytest
+
+from personal_manager import personal_manager as pm
+
+
+def record():
+    return pm.Record("Olena", ["+380501234567"], "12.05.1990", [], ["olena@example.com"], ["call back"])
+
+
+def test_text_is_rendered_once_and_again_after_a_change():
+    contact = record()
+    text = str(contact)
+    assert str(contact) is text and "+380501234567" in text
+    contact.add_phone("+380671112233")
+    assert "+380671112233" in str(contact)
+    contact.edit_phone("+380671112233", "+380639998877")
+    assert "+380639998877" in str(contact) and "+380671112233" not in str(contact)
+    contact.birthday = pm.Birthday("13.05.1990")
+    assert "13.05.1990" in str(contact)
+
+
+def test_render_cache_is_not_pickled():
+    contact = record()
+    text = str(contact)
+    state = contact.__getstate__()[1]
+    assert "_rendered" not in state
+    assert str(pickle.loads(pickle.dumps(contact))) == text == str(contact.copy())
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_stored_records_show_their_edits(backend, tmp_path):
+    book = pm.AddressBook()
+    if backend == "sqlite":
+        book.use_sqlite(str(tmp_path / "book.db"))
+    book["Olena"] = record()
+    before = str(book.data["Olena"])
+    commands = ['edit_record name=Olena emails=olena@mail.org', 'add_note name=Olena note="buy milk"']
+    assert pm.run_batch(book, commands, io.StringIO()) == 0
+    after = str(book.data["Olena"])
+    assert "olena@example.com" in before and "olena@mail.org" in after and "buy milk" in after
+    assert [str(records[0]) for records, _ in book.pages(1)] == [after]
@@ -0,0 +1,45 @@
+import io
+
+import pytest
+
+from personal_manager import personal_manager as pm
+
+COMMANDS = ['add_contact name=Olena phones=+380501234567 emails=olena@example.com birthday=12.05.1990',
+            'add_contact name=Ivan phones=+380671112233 notes="meet at the station"',
+            'add_contact name=Petro emails=petro@mail.org',
+            'edit_record name=Ivan phones=+380639998877 new_name=Ivanko',
+            'add_note name=Petro note="station wagon for sale"',
+            'del_contact name=Olena']
+QUERIES = ["olena", "+38050", "example", "ivan", "ivanko", "+38067", "+380639", "meet at the station",
+           "station wagon for sale", "mail.org", "12.05", "petro", "nobody"]
+
+
+def book_after(commands, backend, tmp_path):
+    book = pm.AddressBook()
+    if backend == "sqlite":
+        book.use_sqlite(str(tmp_path / "book.db"))
+    assert pm.run_batch(book, commands, io.StringIO()) == 0
+    return book
+
+
+def found(book, query):
+    return [record.name.value for record in book.search_contacts(query)]
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_search_follows_the_changes_of_the_contacts(backend, tmp_path):
+    book = book_after(COMMANDS, backend, tmp_path)
+    assert found(book, "olena") == [] and found(book, "example") == []
+    assert found(book, "ivan") == ["Ivanko"] and found(book, "+38067") == []
+    assert found(book, "+380639") == ["Ivanko"] and found(book, "+38") == ["Ivanko"]
+    assert found(book, "meet at the station") == ["Ivanko"]
+    assert found(book, "station wagon for sale") == ["Petro"] and found(book, "station") == []
+
+
+@pytest.mark.parametrize("steps", range(len(COMMANDS) + 1))
+def test_memory_and_sqlite_find_the_same_contacts(steps, tmp_path):
+    memory = book_after(COMMANDS[:steps], "memory", tmp_path / "memory")
+    (tmp_path / "sqlite").mkdir()
+    sqlite = book_after(COMMANDS[:steps], "sqlite", tmp_path / "sqlite")
+    for query in QUERIES:
+        assert found(memory, query) == found(sqlite, query), query
@@ -0,0 +1,192 @@
+import errno
+import os
+
+import pytest
+
+from personal_manager import personal_manager as pm
+
+
+def make_tree(root, files):
+    """Creates the files {relative path: content} under the root"""
+    for name, content in files.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+
+
+def tree(root):
+    """{relative path: content} of the files under the root except the sorter's own state files"""
+    found = {}
+    for folder, _, names in os.walk(root):
+        for name in names:
+            if not name.startswith("."):
+                path = os.path.join(folder, name)
+                with open(path, "rb") as fn:
+                    found[os.path.relpath(path, root)] = fn.read()
+    return found
+
+
+FILES = {"photo.jpg": b"jpg", "notes.txt": b"txt", "a/song.mp3": b"mp3", "a/b/backup.zip": b"zip",
+         "a/b/c/video.mkv": b"mkv", "a/script.py": b"py"}
+
+
+@pytest.fixture(autouse=True)
+def default_settings(monkeypatch, tmp_path):
+    monkeypatch.setenv("PERSONAL_MANAGER_CATEGORIES", str(tmp_path / "no_categories.json"))
+    monkeypatch.delenv("PERSONAL_MANAGER_SORT_DUPLICATES", raising=False)
+    monkeypatch.setattr(pm, "classifier", None)
+
+
+def test_sort_moves_files_into_categories(tmp_path):
+    make_tree(tmp_path, FILES)
+    report = pm.sort_files_entry_point(str(tmp_path))
+    assert tree(tmp_path) == {"images/photo.jpg": b"jpg", "documents/notes.txt": b"txt", "audio/song.mp3": b"mp3",
+                              "archives/backup.zip": b"zip", "video/video.mkv": b"mkv", "a/script.py": b"py"}
+    assert sum(report.files.values()) == 5
+    assert not os.path.exists(tmp_path / "a" / "b")
+
+
+def test_dry_run_changes_nothing(tmp_path):
+    make_tree(tmp_path, FILES)
+    planned = list(pm.planned_moves(str(tmp_path)))
+    pm.sort_files_entry_point(str(tmp_path), dry_run=True)
+    assert tree(tmp_path) == FILES
+    assert {os.path.relpath(destination, tmp_path) for _, destination, _ in planned} == \
+        {"images/photo.jpg", "documents/notes.txt", "audio/song.mp3", "archives/backup.zip", "video/video.mkv"}
+
+
+def test_interrupted_sort_resumes_and_undoes(tmp_path, monkeypatch):
+    make_tree(tmp_path, FILES)
+    manifest = str(tmp_path / pm.SORT_MANIFEST)
+    assert pm.plan_sort(str(tmp_path), manifest) == 5
+    apply = pm.MoveExecutor.apply
+    calls = []
+
+    def interrupted(self, moves):
+        calls.append(moves)
+        if len(calls) == 3:
+            raise KeyboardInterrupt
+        return apply(self, moves)
+
+    monkeypatch.setattr(pm.MoveExecutor, "apply", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        pm.apply_sort(manifest, workers=1, batch_size=1)
+    monkeypatch.setattr(pm.MoveExecutor, "apply", apply)
+    assert pm.manifest_pending(manifest)
+    assert sum(1 for _ in pm.read_manifest(manifest + pm.SORT_DONE_SUFFIX)) == 2
+
+    pm.sort_files_entry_point(str(tmp_path))
+    assert not pm.manifest_pending(manifest)
+    assert set(tree(tmp_path)) == {"images/photo.jpg", "documents/notes.txt", "audio/song.mp3",
+                                   "archives/backup.zip", "video/video.mkv", "a/script.py"}
+
+    assert pm.undo_sort(manifest) == 5
+    assert tree(tmp_path) == FILES
+    assert not os.path.exists(manifest)
+
+
+def test_resume_skips_moves_done_before_the_checkpoint(tmp_path):
+    make_tree(tmp_path, {"x/photo.jpg": b"jpg"})
+    manifest = str(tmp_path / pm.SORT_MANIFEST)
+    pm.plan_sort(str(tmp_path), manifest)
+    os.makedirs(tmp_path / "images")
+    os.rename(tmp_path / "x" / "photo.jpg", tmp_path / "images" / "photo.jpg")
+    assert pm.apply_sort(manifest) == 1
+    assert tree(tmp_path) == {"images/photo.jpg": b"jpg"}
+
+
+def test_name_collision_keeps_both_files(tmp_path):
+    make_tree(tmp_path, {"a/photo.jpg": b"first", "b/photo.jpg": b"second", "images/photo.jpg": b"sorted"})
+    report = pm.sort_files_entry_point(str(tmp_path))
+    images = tree(tmp_path / "images")
+    assert sorted(images.values()) == [b"first", b"second", b"sorted"]
+    assert images["photo.jpg"] == b"sorted"
+    assert report.collisions == 2
+
+
+@pytest.mark.parametrize("mode", ["link", "skip", "keep"])
+def test_duplicates(tmp_path, monkeypatch, mode):
+    monkeypatch.setenv("PERSONAL_MANAGER_SORT_DUPLICATES", mode)
+    make_tree(tmp_path, {"images/photo.jpg": b"same", "a/photo.jpg": b"same"})
+    report = pm.sort_files_entry_point(str(tmp_path))
+    images = tree(tmp_path / "images")
+    if mode == "keep":
+        assert report.duplicates == 0 and report.collisions == 1
+        assert sorted(images.values()) == [b"same", b"same"]
+        return
+    assert report.duplicates == 1
+    if mode == "skip":
+        assert tree(tmp_path) == {"images/photo.jpg": b"same", "a/photo.jpg": b"same"}
+    else:
+        assert len(images) == 2 and not os.path.exists(tmp_path / "a")
+        linked = [os.stat(tmp_path / "images" / name) for name in images]
+        assert linked[0].st_ino == linked[1].st_ino
+
+
+def test_incremental_sort_sorts_only_new_files(tmp_path):
+    make_tree(tmp_path, {"a/photo.jpg": b"jpg"})
+    assert pm.incremental_sort(str(tmp_path), workers=1) == 1
+    assert pm.incremental_sort(str(tmp_path), workers=1) == 0
+    make_tree(tmp_path, {"b/new.txt": b"txt"})
+    assert pm.incremental_sort(str(tmp_path), workers=1) == 1
+    assert tree(tmp_path) == {"images/photo.jpg": b"jpg", "documents/new.txt": b"txt"}
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_name_collision_across_batches(tmp_path, workers):
+    make_tree(tmp_path, {"a/f1.jpg": b"first", "b/f1.jpg": b"second"})
+    executor = pm.MoveExecutor(str(tmp_path), workers)
+    assert executor.run(pm.walk_files(str(tmp_path)), batch_size=1) == 2
+    assert sorted(tree(tmp_path / "images").values()) == [b"first", b"second"]
+    assert len(tree(tmp_path)) == 2
+    assert executor.report.collisions == 1
+
+
+def test_duplicate_across_batches(tmp_path):
+    make_tree(tmp_path, {"a/f1.jpg": b"same", "b/f1.jpg": b"same"})
+    executor = pm.MoveExecutor(str(tmp_path), 1)
+    assert executor.run(pm.walk_files(str(tmp_path)), batch_size=1) == 2
+    assert executor.report.duplicates == 1
+    linked = [os.stat(tmp_path / "images" / name) for name in tree(tmp_path / "images")]
+    assert len(linked) == 2 and linked[0].st_ino == linked[1].st_ino
+
+
+@pytest.fixture
+def cross_device(monkeypatch):
+    """Makes os.rename fail as if the destination was on another filesystem"""
+    def rename(source, destination):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    monkeypatch.setattr(pm.os, "rename", rename)
+
+
+@pytest.mark.parametrize("method", ["copy_file_range", "sendfile"])
+def test_move_across_filesystems_falls_back_when_kernel_copy_copies_nothing(tmp_path, monkeypatch, cross_device,
+                                                                             method):
+    monkeypatch.setattr(pm.os, method, lambda *args: 0, raising=False)
+    if method == "sendfile":
+        monkeypatch.delattr(pm.os, "copy_file_range", raising=False)
+    make_tree(tmp_path, {"a/photo.jpg": b"jpg" * 1000})
+    pm.move_file(str(tmp_path / "a" / "photo.jpg"), str(tmp_path / "photo.jpg"))
+    assert tree(tmp_path) == {"photo.jpg": b"jpg" * 1000}
+
+
+def test_move_across_filesystems_keeps_the_source_of_a_short_copy(tmp_path, monkeypatch, cross_device):
+    def short_copy(source, destination, progress=None):
+        with open(destination, "wb") as fn:
+            return fn.write(b"j")
+
+    monkeypatch.setattr(pm, "copy_file", short_copy)
+    make_tree(tmp_path, {"a/photo.jpg": b"jpg"})
+    with pytest.raises(OSError):
+        pm.move_file(str(tmp_path / "a" / "photo.jpg"), str(tmp_path / "photo.jpg"))
+    assert tree(tmp_path) == {"a/photo.jpg": b"jpg"}
+
+
+def test_sort_prunes_only_the_folders_it_emptied(tmp_path):
+    make_tree(tmp_path, {"a/b/c/video.mkv": b"mkv", "a/b/notes.py": b"py", "d/e/photo.jpg": b"jpg"})
+    (tmp_path / "untouched" / "empty").mkdir(parents=True)
+    pm.sort_files_entry_point(str(tmp_path))
+    assert not os.path.exists(tmp_path / "a" / "b" / "c") and not os.path.exists(tmp_path / "d")
+    assert os.path.isdir(tmp_path / "untouched" / "empty")
+    assert set(tree(tmp_path)) == {"video/video.mkv", "a/b/notes.py", "images/photo.jpg"}
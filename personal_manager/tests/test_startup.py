@@ -0,0 +1,32 @@
+import sys
+
+import pytest
+
+from personal_manager import personal_manager as pm
+
+
+def test_background_load_raises_the_error_of_the_loading():
+    def load():
+        print("loading")
+        raise EOFError("Ran out of input")
+
+    stdout = sys.stdout
+    loading = pm.BackgroundLoad(load)
+    with pytest.raises(EOFError):
+        loading.wait()
+    assert sys.stdout is stdout
+
+
+@pytest.mark.parametrize("content", [b"", b"\x80\x04\x95truncated"])
+def test_damaged_snapshot_is_reported_and_journaled(tmp_path, capsys, content):
+    filename = tmp_path / "book.bin"
+    filename.write_bytes(content)
+    book = pm.AddressBook()
+    book.load_data(str(filename))
+    assert "An error occurred while opening the file" in capsys.readouterr().out
+    assert book.journal is not None
+    book["alice"] = pm.Record("alice", [], None, [], ["alice@example.com"], [])
+    book.flush_journal()
+    restored = pm.AddressBook()
+    restored.load_data(str(filename))
+    assert list(restored.data) == ["alice"]
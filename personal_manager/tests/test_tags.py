@@ -0,0 +1,54 @@
+import io
+from datetime import datetime
+
+import pytest
+
+from personal_manager import personal_manager as pm
+
+NOTES = [("Alice", "groceries", ["home", "urgent"], 1), ("Bob", "report", ["work", "urgent"], 2),
+         ("Alice", "garden", ["home"], 3), ("Carol", "slides", ["work"], 4), ("Bob", "dentist", ["urgent"], 5)]
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def book(request, tmp_path):
+    book = pm.AddressBook()
+    if request.param == "sqlite":
+        book.use_sqlite(str(tmp_path / "book.db"))
+    records = {}
+    for name, text, tags, day in NOTES:
+        note = pm.Note(text, tags)
+        note._created_at = datetime(2024, 1, day)
+        records.setdefault(name, pm.Record(name, [], None, [], [], [])).note.append(note)
+    for name, record in records.items():
+        book[name] = record
+    return book
+
+
+def found(book, tags, match_all=False, page=0, page_size=None):
+    return [note.value for _, note in book.notes_by_tags(tags, match_all, page, page_size)]
+
+
+def test_notes_with_any_tag_come_newest_first(book):
+    assert found(book, ["urgent"]) == ["dentist", "report", "groceries"]
+    assert found(book, ["home", "work"]) == ["slides", "garden", "report", "groceries"]
+    assert found(book, ["missing"]) == [] and found(book, []) == []
+
+
+def test_notes_with_all_tags(book):
+    assert found(book, ["urgent", "work"], match_all=True) == ["report"]
+    assert found(book, ["urgent", "missing"], match_all=True) == []
+
+
+def test_pages_of_the_found_notes(book):
+    assert found(book, ["urgent", "home", "work"], page=1, page_size=2) == ["garden", "report"]
+    assert found(book, ["urgent", "home", "work"], page=2, page_size=2) == ["groceries"]
+    assert found(book, ["urgent", "home", "work"], page=3, page_size=2) == []
+
+
+def test_postings_follow_the_changes_of_the_notes(book):
+    commands = ['add_tag name=Carol index=0 tags=urgent', 'del_note name=Bob index=1',
+                'edit_note name=Alice index=0 note=errands tags=errand', 'del_contact name=Carol']
+    assert pm.run_batch(book, commands, io.StringIO()) == 0
+    assert found(book, ["urgent"]) == ["report"]
+    assert found(book, ["home"]) == ["garden"] and found(book, ["errand"]) == ["errands"]
+    assert found(book, ["work"]) == ["report"]